@@ -8,4 +8,6 @@ __author__ = 'Raphaël Barrois <raphael.barrois+extypes@polytechnique.org>'
 
 from .base import (  # noqa
     ConstrainedSet,
+    FrozenConstrainedSet,
+    declare_compatible,
 )
@@ -4,10 +4,15 @@
 
 from __future__ import unicode_literals
 
-from . import compat
+import binascii
+import hashlib
+import threading
+import weakref
 
+from . import compat, instrumentation, representations
 
-def ConstrainedSet(choices, name=None):
+
+def ConstrainedSet(choices, name=None, representation=representations.BITMASK):
     """A constrained set, where values are restricted to a set of options.
 
     Syntax:
@@ -20,54 +25,415 @@ def ConstrainedSet(choices, name=None):
 
     All item-based operations will raise ``ValueError`` if the value isn't part
     of the allowed options.
+
+    Values are stored as an integer bitmask; for large sets of options, use
+    ``representation='sparse'`` or ``representation='chunked'`` to keep the cost
+    of a value proportional to its contents (see extypes.representations).
     """
-    if not name:
-        if compat.PY2:
-            name = b'ConstrainedSet'
-        else:
-            name = 'ConstrainedSet'
+    return _make_class(BaseConstrainedSet, choices, name or str('ConstrainedSet'), representation)
 
-    return type(name, (BaseConstrainedSet,), {'name': name, 'choices': choices})
 
+def FrozenConstrainedSet(choices, name=None, representation=representations.BITMASK):
+    """An immutable, hashable constrained set.
 
-class BaseConstrainedSet(object):
-    choices = None
+    Syntax:
 
-    def __init__(self, initial=()):
-        initial = set(initial)
-        self._validate_choices(initial)
-        self.enabled_choices = initial
+    >>> MyFrozenSet = FrozenConstrainedSet(['a', 'b', 'c'], name='MyFrozenSet')
+    >>> x = MyFrozenSet(['a'])
+    >>> x | MyFrozenSet(['b']) is MyFrozenSet(['a', 'b'])
+    True
+
+    Instances are interned: building the same value twice returns the same object.
+    """
+    return _make_class(BaseFrozenConstrainedSet, choices, name or str('FrozenConstrainedSet'), representation)
 
-    def _validate_choices(self, values):
-        invalid_keys = set(values) - set(self.choices)
-        if invalid_keys:
+
+def _make_class(base, choices, name, representation=representations.BITMASK):
+    """Generate (or retrieve from the cache) a subclass of base for the given choices."""
+    if representation not in representations.REPRESENTATIONS:
+        raise ValueError(
+            "representation must be one of %s; got %r" % (list(representations.REPRESENTATIONS), representation)
+        )
+    try:
+        cache_key = (base, name, representation, _freeze_choices(choices))
+        return _class_cache[cache_key]
+    except TypeError:
+        # Unhashable choices (e.g. list values in a dict): don't intern.
+        cache_key = None
+    except KeyError:
+        pass
+
+    namespace = _choice_index(base, choices, representation)
+    namespace.update({
+        '__slots__': (),
+        'name': name,
+        'choices': choices,
+    })
+    bases = (base,) if representation == representations.BITMASK else (MaskObjectMixin, base)
+    fingerprint = namespace['_fingerprint']
+
+    cls = type(name, bases, namespace)
+    if cache_key is not None:
+        cls = _class_cache.setdefault(cache_key, cls)
+    if cls._compatibility_group is namespace['_compatibility_group']:
+        cls._compatibility_group.classes.add(cls)
+    registered = _class_registry.setdefault((base, name, fingerprint, representation), cls)
+    if registered is not cls:
+        # Same name and choices, e.g. from a tuple instead of a list: values unpickle
+        # to the registered class, so they must be comparable.
+        declare_compatible(registered, cls)
+    return cls
+
+
+def _choice_index(base, choices, representation=representations.BITMASK):
+    """The class attributes indexing choices, for a subclass of base."""
+    keys = tuple(choices)
+    index = {
+        '_keys': keys,
+        '_choice_set': frozenset(keys),
+        '_fingerprint': _compute_fingerprint(choices, keys, representation),
+        '_representation': representation,
+        '_compatibility_group': _CompatibilityGroup(),
+        '_counterparts': {},
+    }
+    if representation == representations.BITMASK:
+        # Choice index: each choice is stored as a single bit of an integer mask.
+        index.update({
+            '_bits': dict((key, 1 << position) for position, key in enumerate(keys)),
+            '_full_mask': (1 << len(keys)) - 1,
+        })
+    else:
+        mask_type = representations.MASK_TYPES[representation]
+        index.update({
+            '_mask_type': mask_type,
+            '_positions': dict((key, position) for position, key in enumerate(keys)),
+            '_full_mask': mask_type.full(len(keys)),
+            '_empty_mask': mask_type.empty(len(keys)),
+        })
+    if issubclass(base, BaseFrozenConstrainedSet):
+        index['_instances'] = weakref.WeakValueDictionary()
+    return index
+
+
+def declare_compatible(*classes):
+    """Allow instances of several constrained set classes to be combined and compared.
+
+    Syntax:
+
+    >>> Foods = ConstrainedSet(['spam', 'eggs'], name='Foods')
+    >>> Dishes = ConstrainedSet(['spam', 'eggs'], name='Dishes')
+    >>> declare_compatible(Foods, Dishes)
+    >>> Foods(['spam']) | Dishes(['eggs'])
+    Foods(['spam', 'eggs'], ['spam', 'eggs'])
+
+    All classes must have the same choices, in the same order, and representation;
+    operations return an instance of the left operand's class.
+    Compatibility is transitive: classes already declared compatible with one of
+    the classes become compatible with all of them.
+    """
+    if not classes:
+        return
+    reference = classes[0]
+    for cls in classes[1:]:
+        if cls._keys != reference._keys:
             raise ValueError(
-                "Invalid keys %r, please use a value from %s." %
-                (list(sorted(invalid_keys)), list(self.choices))
+                "Can't declare %s and %s compatible: choices differ (%r != %r)."
+                % (reference.__name__, cls.__name__, list(reference._keys), list(cls._keys))
             )
+        if cls._representation != reference._representation:
+            raise ValueError(
+                "Can't declare %s and %s compatible: representations differ (%r != %r)."
+                % (reference.__name__, cls.__name__, reference._representation, cls._representation)
+            )
+
+    group = reference._compatibility_group
+    for cls in classes[1:]:
+        if cls._compatibility_group is group:
+            continue
+        for member in list(cls._compatibility_group.classes):
+            member._compatibility_group = group
+            group.classes.add(member)
+
+
+class _CompatibilityGroup(object):
+    """Shared by classes whose instances can be combined; see declare_compatible()."""
+    __slots__ = ('classes', '__weakref__')
+
+    def __init__(self):
+        self.classes = weakref.WeakSet()
+
+
+# Generated classes, interned by (base class, name, representation, choices).
+_class_cache = {}
+
+
+# Generated classes, by (base class, name, fingerprint, representation); used for unpickling.
+_class_registry = weakref.WeakValueDictionary()
+
+# Serializes the creation of interned frozen instances; lookups of existing instances don't lock.
+_interning_lock = threading.Lock()
+
+# Length of class fingerprints, in bytes.
+FINGERPRINT_SIZE = 4
+
+
+def _compute_fingerprint(choices, keys, representation=representations.BITMASK):
+    """A short, process-independent fingerprint of choices: their keys in order, labels and representation."""
+    if hasattr(choices, 'items'):
+        labels = tuple(compat.text_type(choices[key]) for key in keys)
+    else:
+        labels = keys
+    description = (keys, labels)
+    if representation != representations.BITMASK:
+        # Serialized values depend on the representation.
+        description += (representation,)
+    return hashlib.sha1(repr(description).encode('utf-8')).digest()[:FINGERPRINT_SIZE]
+
+
+def _restore(base, name, fingerprint, mask, representation=representations.BITMASK):
+    """Unpickle a constrained set; see AbstractConstrainedSet.__reduce__."""
+    try:
+        cls = _class_registry[(base, name, fingerprint, representation)]
+    except KeyError:
+        raise ValueError(
+            "Unknown %s class %r; it must be defined in this process before unpickling." % (base.__name__, name)
+        )
+    return cls.from_mask(mask)
+
+
+def _freeze_choices(choices):
+    """Build a hashable equivalent of a choices list / dict."""
+    if hasattr(choices, 'items'):
+        return (type(choices), tuple(choices.items()))
+    return (type(choices), tuple(choices))
+
+
+class _ConstrainedSetMeta(type):
+    """Index the choices of constrained set classes declaring them in their body.
+
+    Classes generated by ConstrainedSet() and FrozenConstrainedSet() are indexed by _make_class() instead.
+    """
+
+    def __init__(cls, name, bases, namespace):
+        super(_ConstrainedSetMeta, cls).__init__(name, bases, namespace)
+        if namespace.get('choices') is not None and '_keys' not in namespace:
+            for attr, value in _choice_index(cls, cls.choices, cls._representation).items():
+                setattr(cls, attr, value)
+            if 'name' not in namespace:
+                cls.name = name
+            cls._compatibility_group.classes.add(cls)
+
+
+class AbstractConstrainedSet(compat.with_metaclass(_ConstrainedSetMeta, object)):
+    """Common (read-only) behaviour of mutable and frozen constrained sets.
+
+    Enabled choices are stored as an integer bitmask: the choice at position
+    ``i`` in ``choices`` is enabled iff bit ``i`` of ``_mask`` is set.
+    """
+    __slots__ = ('_mask',)
+
+    name = None
+    choices = None
+    _keys = ()
+    _choice_set = frozenset()
+    _bits = {}
+    _full_mask = 0
+    _empty_mask = 0
+    _fingerprint = _compute_fingerprint((), ())
+    _representation = representations.BITMASK
+    _compatibility_group = _CompatibilityGroup()
+
+    @classmethod
+    def _from_mask(cls, mask):
+        """Build an instance from a (trusted) bitmask, skipping validation."""
+        instance = object.__new__(cls)
+        instance._mask = mask
+        return instance
+
+    # Batch constructors
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Build an instance from its bitmask (bit i <=> choices[i])."""
+        if mask < 0 or mask & ~cls._full_mask:
+            raise ValueError("Invalid mask %r for %s, expected at most %d bits." % (mask, cls.__name__, len(cls._keys)))
+        return cls._from_mask(mask)
+
+    @classmethod
+    def from_many(cls, values):
+        """Build a list of instances, from an iterable of iterables of keys."""
+        mask_from, from_mask = cls._mask_from, cls._from_mask
+        return [from_mask(mask_from(value)) for value in values]
+
+    @classmethod
+    def from_strings(cls, values, sep=','):
+        """Build a list of instances from sep-separated strings, as generated by str().
+
+        Each distinct string is only parsed once.
+        """
+        masks = {}
+        from_mask = cls._from_mask
+        result = []
+        for value in values:
+            mask = masks.get(value)
+            if mask is None:
+                mask = masks[value] = cls._mask_from([key for key in value.split(sep) if key])
+            result.append(from_mask(mask))
+        return result
+
+    # Serialization
+
+    def to_bytes(self):
+        """Compact binary representation: class fingerprint, then the mask (little-endian).
+
+        The mask uses a fixed width of ceil(len(choices) / 8) bytes.
+        """
+        return self._fingerprint + self.to_mask().to_bytes((len(self._keys) + 7) // 8, 'little')
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Build an instance from the output of to_bytes()."""
+        mask = cls._check_fingerprint(data)
+        if len(mask) != (len(cls._keys) + 7) // 8:
+            raise ValueError("Invalid data length %d for %s." % (len(data), cls.__name__))
+        return cls.from_mask(int.from_bytes(mask, 'little'))
+
+    @classmethod
+    def _check_fingerprint(cls, data):
+        """Check the fingerprint of the output of to_bytes(), and return the remaining data."""
+        data = bytes(data)
+        if data[:FINGERPRINT_SIZE] != cls._fingerprint:
+            raise ValueError("Data wasn't generated from a %s with the same choices." % cls.__name__)
+        return data[FINGERPRINT_SIZE:]
+
+    def __reduce__(self):
+        # Generated classes can't be pickled by reference: pickle how to find them
+        # in the unpickling process instead.
+        # Classes with the same name and fingerprint have the same choices, and are compatible:
+        # values unpickle to the first one defined.
+        base = self.__class__.__base__
+        _class_registry.setdefault((base, self.name, self._fingerprint, self._representation), self.__class__)
+        args = (base, self.name, self._fingerprint, self.to_mask())
+        if self._representation != representations.BITMASK:
+            args += (self._representation,)
+        return (_restore, args)
+
+    def to_mask(self):
+        """The bitmask of enabled choices, as an integer (bit i <=> choices[i])."""
+        return self._mask
+
+    @classmethod
+    def _mask_from(cls, values):
+        """Compute the bitmask for an iterable of keys."""
+        if isinstance(values, AbstractConstrainedSet) and cls._shares_masks(values):
+            return values._mask
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            values = list(values)
+        bits = cls._bits
+        mask = 0
+        try:
+            for value in values:
+                mask |= bits[value]
+        except KeyError:
+            cls._validate_choices(values)
+            raise
+        return mask
+
+    @classmethod
+    def _shares_masks(cls, other):
+        """Whether masks of another constrained set can be used as is by this class."""
+        return other._compatibility_group is cls._compatibility_group or (
+            other._keys == cls._keys and other._representation == cls._representation
+        )
+
+    @classmethod
+    def _bit(cls, key):
+        """Retrieve the bit of a single key, raising ValueError if invalid."""
+        try:
+            return cls._bits[key]
+        except KeyError:
+            cls._validate_choices([key])
+            raise
+
+    @classmethod
+    def _validate_choices(cls, values):
+        if cls._choice_set.issuperset(values):
+            return
+        invalid_keys = set(values) - cls._choice_set
+        raise ValueError(
+            "Invalid keys %r, please use a value from %s." %
+            (list(sorted(invalid_keys)), list(cls.choices))
+        )
+
+    # Mutable / frozen counterparts
+
+    @classmethod
+    def _counterpart(cls, base):
+        """The class generated from base for the same choices, name and representation."""
+        if issubclass(cls, base):
+            return cls
+        counterparts = cls.__dict__.get('_counterparts')
+        if counterparts is None:
+            # Not a generated class: don't cache.
+            return _make_class(base, cls.choices, cls.name, cls._representation)
+        counterpart = counterparts.get(base)
+        if counterpart is None:
+            counterpart = counterparts.setdefault(base, _make_class(base, cls.choices, cls.name, cls._representation))
+        return counterpart
+
+    def freeze(self):
+        """An immutable, hashable copy of this set, safe to share between threads.
+
+        Returns self for frozen sets; otherwise, the copy shares this set's mask.
+        """
+        return self._counterpart(BaseFrozenConstrainedSet)._from_mask(self._mask)
+
+    def thaw(self):
+        """A new mutable copy of this set.
+
+        The copy shares this set's (immutable) mask until modified, so this is O(1).
+        """
+        return self._counterpart(BaseConstrainedSet)._from_mask(self._mask)
+
+    @property
+    def enabled_choices(self):
+        """The enabled choices, as a (read-only) frozenset."""
+        return frozenset(self._iter_keys())
+
+    def _iter_keys(self):
+        """Iterate over enabled keys, in choices order.
+
+        Walks the set bits only, so this is O(len(self)) rather than O(len(choices)).
+        """
+        keys = self._keys
+        mask = self._mask
+        while mask:
+            lowest = mask & -mask
+            yield keys[lowest.bit_length() - 1]
+            mask ^= lowest
 
     # Dict-like
 
     def keys(self):
-        return [key for key in self.choices if key in self.enabled_choices]
+        """A dynamic view on the enabled keys."""
+        return ConstrainedSetKeysView(self)
 
     def values(self):
-        """Retrieve the values associated with the keys.
+        """A dynamic view on the values associated with the keys.
 
         Only supported if the choices are a dict.
         """
-        return [value for key, value in self.choices.items() if key in self.enabled_choices]
+        return ConstrainedSetValuesView(self)
 
     def items(self):
-        """Retrieve the items associated with the keys.
+        """A dynamic view on the (key, value) items.
 
         Only supported if the choices are a dict.
         """
-        return [(key, value) for key, value in self.choices.items() if key in self.enabled_choices]
+        return ConstrainedSetItemsView(self)
 
     def __getitem__(self, key):
-        self._validate_choices([key])
-        if key not in self.enabled_choices:
+        if not self._mask & self._bit(key):
             raise KeyError("Key %r not in %r" % (key, self.enabled_choices))
         return self.choices[key]
 
@@ -75,55 +441,40 @@ class BaseConstrainedSet(object):
 
     # ~ self
     def __invert__(self):
-        return self.__class__(set(self.choices) - self.enabled_choices)
+        return self._from_mask(self._full_mask & ~self._mask)
 
     # Dict & set-like
 
     def __iter__(self):
-        return iter(self.keys())
-
-    def copy(self):
-        return self.__class__(self.enabled_choices.copy())
+        return self._iter_keys()
 
     # Set-like
 
     def __len__(self):
-        return len(self.enabled_choices)
+        return compat.popcount(self._mask)
 
     def __bool__(self):
-        return bool(self.enabled_choices)
+        return bool(self._mask)
 
     def __nonzero__(self):
-        return bool(self.enabled_choices)
+        return bool(self._mask)
 
     def __contains__(self, key):
-        self._validate_choices([key])
-        return key in self.enabled_choices
-
-    # Set edition
-
-    def add(self, value):
-        self._validate_choices([value])
-        return self.enabled_choices.add(value)
-
-    def remove(self, value):
-        self._validate_choices([value])
-        return self.enabled_choices.remove(value)
-
-    def discard(self, value):
-        self._validate_choices([value])
-        return self.enabled_choices.discard(value)
-
-    def pop(self):
-        return self.enabled_choices.pop()
-
-    def clear(self):
-        return self.enabled_choices.clear()
+        # Hot path: inline self._bit(key).
+        try:
+            return bool(self._mask & self._bits[key])
+        except KeyError:
+            self._validate_choices([key])
+            raise
 
     # Inter-set methods
 
     def _comparable(self, other):
-        return isinstance(other, self.__class__) and other.choices == self.choices
+        # Classes generated for the same choices, or declared compatible, share a group: no need to compare choices.
+        return (
+            other.__class__ is self.__class__
+            or getattr(other, '_compatibility_group', None) is self._compatibility_group
+        )
 
     def _ensure_comparable(self, other):
         if not self._comparable(other):
@@ -132,18 +483,18 @@ class BaseConstrainedSet(object):
     # Comparison
 
     def __eq__(self, other):
-        return self._comparable(other) and self.enabled_choices == other.enabled_choices
+        return self._comparable(other) and self._mask == other._mask
 
     def __ne__(self, other):
-        return not self._comparable(other) or self.enabled_choices != other.enabled_choices
+        return not self._comparable(other) or self._mask != other._mask
 
     def isdisjoint(self, other):
         self._ensure_comparable(other)
-        return self.enabled_choices.isdisjoint(other.enabled_choices)
+        return not self._mask & other._mask
 
     def issubset(self, other):
         self._ensure_comparable(other)
-        return self.enabled_choices <= other.enabled_choices
+        return not self._mask & ~other._mask
 
     def __le__(self, other):
         return self.issubset(other)
@@ -153,7 +504,7 @@ class BaseConstrainedSet(object):
 
     def issuperset(self, other):
         self._ensure_comparable(other)
-        return self.enabled_choices >= other.enabled_choices
+        return not other._mask & ~self._mask
 
     def __ge__(self, other):
         return self.issuperset(other)
@@ -165,7 +516,7 @@ class BaseConstrainedSet(object):
 
     def union(self, other):
         self._ensure_comparable(other)
-        return self.__class__(self.enabled_choices | other.enabled_choices)
+        return self._from_mask(self._mask | other._mask)
 
     # self | other
     def __or__(self, other):
@@ -173,7 +524,7 @@ class BaseConstrainedSet(object):
 
     def intersection(self, other):
         self._ensure_comparable(other)
-        return self.__class__(self.enabled_choices & other.enabled_choices)
+        return self._from_mask(self._mask & other._mask)
 
     # self & other
     def __and__(self, other):
@@ -181,7 +532,7 @@ class BaseConstrainedSet(object):
 
     def difference(self, other):
         self._ensure_comparable(other)
-        return self.__class__(self.enabled_choices - other.enabled_choices)
+        return self._from_mask(self._mask & ~other._mask)
 
     # self - other
     def __sub__(self, other):
@@ -189,17 +540,177 @@ class BaseConstrainedSet(object):
 
     def symmetric_difference(self, other):
         self._ensure_comparable(other)
-        return self.__class__(self.enabled_choices ^ other.enabled_choices)
+        return self._from_mask(self._mask ^ other._mask)
 
     # self ^ other
     def __xor__(self, other):
         return self.symmetric_difference(other)
 
+    def __repr__(self):
+        return '%s(%r, %r)' % (
+            self.__class__.__name__,
+            self.choices,
+            list(self._iter_keys()),
+        )
+
+    def __str__(self):
+        return ','.join(self._iter_keys())
+
+
+class ConstrainedSetKeysView(compat.abc.KeysView):
+    """Keys of a ConstrainedSet, in choices order."""
+    __slots__ = ()
+
+    def __contains__(self, key):
+        return key in self._mapping._choice_set and key in self._mapping
+
+    def __iter__(self):
+        return self._mapping._iter_keys()
+
+
+class ConstrainedSetValuesView(compat.abc.ValuesView):
+    """Values associated with the keys of a ConstrainedSet, in choices order."""
+    __slots__ = ()
+
+    def __iter__(self):
+        choices = self._mapping.choices
+        for key in self._mapping._iter_keys():
+            yield choices[key]
+
+
+class ConstrainedSetItemsView(compat.abc.ItemsView):
+    """(key, value) items of a ConstrainedSet, in choices order."""
+    __slots__ = ()
+
+    def __contains__(self, item):
+        key, value = item
+        return key in self._mapping.keys() and self._mapping.choices[key] == value
+
+    def __iter__(self):
+        choices = self._mapping.choices
+        for key in self._mapping._iter_keys():
+            yield (key, choices[key])
+
+
+class MaskObjectMixin(object):
+    """Mixin for classes storing values as an extypes.representations mask instead of an integer.
+
+    Mask objects support the operators used by AbstractConstrainedSet; this
+    overrides the methods relying on integer-specific operations.
+    """
+    __slots__ = ()
+
+    _mask_type = None
+    _positions = {}
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Build an instance from its bitmask (bit i <=> choices[i]), or from a mask of _mask_type."""
+        if isinstance(mask, cls._mask_type):
+            return cls._from_mask(mask)
+        if mask < 0 or mask >> len(cls._keys):
+            raise ValueError("Invalid mask %r for %s, expected at most %d bits." % (mask, cls.__name__, len(cls._keys)))
+        return cls._from_mask(cls._mask_type.from_int(mask, len(cls._keys)))
+
+    def to_mask(self):
+        return self._mask.to_int()
+
+    def to_bytes(self):
+        """Compact binary representation: class fingerprint, then the mask's stored positions.
+
+        Its size is proportional to the number of stored positions; see ComplementableMask.to_bytes().
+        """
+        return self._fingerprint + self._mask.to_bytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls._from_mask(cls._mask_type.from_bytes(cls._check_fingerprint(data), len(cls._keys)))
+
+    @classmethod
+    def _mask_from(cls, values):
+        if isinstance(values, AbstractConstrainedSet) and cls._shares_masks(values):
+            return values._mask
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            values = list(values)
+        positions = cls._positions
+        try:
+            return cls._mask_type.from_positions([positions[value] for value in values], len(cls._keys))
+        except KeyError:
+            cls._validate_choices(values)
+            raise
+
+    @classmethod
+    def _bit(cls, key):
+        try:
+            position = cls._positions[key]
+        except KeyError:
+            cls._validate_choices([key])
+            raise
+        return cls._mask_type.from_positions([position], len(cls._keys))
+
+    def _iter_keys(self):
+        keys = self._keys
+        for position in self._mask.iter_positions():
+            yield keys[position]
+
+    def __len__(self):
+        return self._mask.popcount()
+
+    def __contains__(self, key):
+        try:
+            return self._mask.has(self._positions[key])
+        except KeyError:
+            self._validate_choices([key])
+            raise
+
+
+class BaseConstrainedSet(AbstractConstrainedSet):
+    """Base class for mutable constrained sets."""
+    __slots__ = ()
+
+    def __init__(self, initial=()):
+        self._mask = self._mask_from(initial)
+
+    def copy(self):
+        return self._from_mask(self._mask)
+
+    # Set edition
+
+    def add(self, value):
+        self._mask |= self._bit(value)
+
+    def remove(self, value):
+        bit = self._bit(value)
+        if not self._mask & bit:
+            raise KeyError(value)
+        self._mask &= ~bit
+
+    def discard(self, value):
+        self._mask &= ~self._bit(value)
+
+    def add_many(self, values):
+        """Add all keys from an iterable."""
+        self._mask |= self._mask_from(values)
+
+    def discard_many(self, values):
+        """Discard all keys from an iterable."""
+        self._mask &= ~self._mask_from(values)
+
+    def pop(self):
+        if not self._mask:
+            raise KeyError('pop from an empty set')
+        key = next(self._iter_keys())
+        self._mask &= ~self._bit(key)
+        return key
+
+    def clear(self):
+        self._mask = self._empty_mask
+
     # Self-edition with other
 
     def update(self, other):
         self._ensure_comparable(other)
-        self.enabled_choices |= other.enabled_choices
+        self._mask |= other._mask
 
     # self |= other
     def __ior__(self, other):
@@ -208,7 +719,7 @@ class BaseConstrainedSet(object):
 
     def intersection_update(self, other):
         self._ensure_comparable(other)
-        self.enabled_choices &= other.enabled_choices
+        self._mask &= other._mask
 
     # self &= other
     def __iand__(self, other):
@@ -217,7 +728,7 @@ class BaseConstrainedSet(object):
 
     def difference_update(self, other):
         self._ensure_comparable(other)
-        self.enabled_choices -= other.enabled_choices
+        self._mask &= ~other._mask
 
     # self -= other
     def __isub__(self, other):
@@ -226,19 +737,71 @@ class BaseConstrainedSet(object):
 
     def symmetric_difference_update(self, other):
         self._ensure_comparable(other)
-        self.enabled_choices ^= other.enabled_choices
+        self._mask ^= other._mask
 
     # self ^= other
     def __ixor__(self, other):
         self.symmetric_difference_update(other)
         return self
 
-    def __repr__(self):
-        return '%s(%r, %r)' % (
-            self.__class__.__name__,
-            self.choices,
-            self.keys(),
-        )
 
-    def __str__(self):
-        return ','.join(self.keys())
+class BaseFrozenConstrainedSet(AbstractConstrainedSet):
+    """Base class for immutable, hashable constrained sets.
+
+    Instances are interned per class and value.
+    """
+    __slots__ = ('__weakref__',)
+
+    # Interned instances, by mask
+    _instances = weakref.WeakValueDictionary()
+
+    def __new__(cls, initial=()):
+        return cls._from_mask(cls._mask_from(initial))
+
+    @classmethod
+    def _from_mask(cls, mask):
+        instances = cls._instances
+        instance = instances.get(mask)
+        if instance is None:
+            # WeakValueDictionary.setdefault() isn't atomic: only lock when creating an instance.
+            with _interning_lock:
+                instance = instances.get(mask)
+                if instance is None:
+                    instance = super(BaseFrozenConstrainedSet, cls)._from_mask(mask)
+                    instances[mask] = instance
+        return instance
+
+    def __hash__(self):
+        return hash(self._mask)
+
+    def copy(self):
+        return self
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _class_label(target):
+    """Owner label of a constrained set class in extypes.instrumentation: 'name[fingerprint]'.
+
+    Unnamed classes, e.g. those generated for SetField choices, share their name: the fingerprint tells them apart.
+    """
+    cls = target if isinstance(target, type) else target.__class__
+    return '%s[%s]' % (cls.__name__, binascii.hexlify(cls._fingerprint).decode('ascii'))
+
+
+# Profiled methods; see extypes.instrumentation.
+instrumentation.register(AbstractConstrainedSet, [
+    'from_mask', 'from_many', 'from_strings', 'from_bytes', '_validate_choices', '__contains__',
+    '__eq__', '__ne__', 'isdisjoint', 'issubset', 'issuperset',
+    'union', 'intersection', 'difference', 'symmetric_difference', '__invert__',
+], owner=_class_label)
+instrumentation.register(MaskObjectMixin, ['from_mask', '__contains__'], owner=_class_label)
+instrumentation.register(BaseConstrainedSet, [
+    '__init__', 'add', 'remove', 'discard', 'add_many', 'discard_many',
+    'update', 'intersection_update', 'difference_update', 'symmetric_difference_update',
+], owner=_class_label)
+instrumentation.register(BaseFrozenConstrainedSet, ['__new__'], owner=_class_label)
@@ -11,5 +11,30 @@ import sys
 
 if sys.version_info[0] == 2:
     PY2 = True
+    import collections as abc  # noqa
+    text_type = unicode  # noqa
+    string_types = (basestring,)  # noqa
+    integer_types = (int, long)  # noqa
 else:
     PY2 = False
+    from collections import abc  # noqa
+    text_type = str
+    string_types = (str,)
+    integer_types = (int,)
+
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:
+    def popcount(value):
+        """Number of bits set in a non-negative integer."""
+        return bin(value).count('1')
+
+
+def with_metaclass(meta, *bases):
+    """Base classes declaring a metaclass, with a syntax common to Python 2 and 3."""
+    class metaclass(type):
+        # Replaced by the actual metaclass when building the class deriving from the returned one.
+        def __new__(mcs, name, this_bases, namespace):
+            return meta(name, bases, namespace)
+    return type.__new__(metaclass, str('temporary_class'), (), {})
@@ -6,98 +6,634 @@
 from __future__ import absolute_import, unicode_literals
 
 import collections
+import functools
 
 import django
 from django.db import models
-from django.forms import fields as forms_fields
-from django.utils import six
-from django.utils.itercompat import is_iterable
+from django.utils.functional import cached_property
 
 import extypes
 from extypes import base as extypes_base
+from extypes import compat, instrumentation
 
 """extypes-based models for Django."""
 
 
-class SetField(models.Field):
-    """A SQL SET field.
+STORAGE_TEXT = 'text'
+STORAGE_BITMASK = 'bitmask'
+STORAGE_ARRAY = 'array'
 
-    Usage:
-    >>> my_field = extypes.django.SetField(['a', 'b', 'c'])
+UPDATE_ADD = 'add'
+UPDATE_REMOVE = 'remove'
+UPDATE_TOGGLE = 'toggle'
+
+# Per-key outcome of an update
+UPDATE_KEEP = 'keep'
+UPDATE_ENABLE = 'enable'
+UPDATE_DISABLE = 'disable'
+UPDATE_FLIP = 'flip'
+
+
+class BaseStorage(object):
+    """How a SetField stores its values in the database."""
+    name = None
+
+    def __init__(self, field):
+        self.field = field
+
+    def db_type(self, connection):
+        raise NotImplementedError()
+
+    def to_db(self, value):
+        """Convert a value to its database-independent storage format."""
+        raise NotImplementedError()
+
+    def get_db_prep_value(self, value, connection):
+        """Adapt the output of to_db() to a specific database."""
+        return value
+
+    def gin_index_sql(self, connection):
+        """SQL template for a GIN index on the field, or None if unsupported."""
+        return None
+
+    def _key_states(self, value, operation):
+        """Yield (key, state) for each choice, in order, for an update operation on value's keys.
+
+        state is one of UPDATE_KEEP, UPDATE_ENABLE, UPDATE_DISABLE or UPDATE_FLIP.
+        """
+        state = {
+            UPDATE_ADD: UPDATE_ENABLE,
+            UPDATE_REMOVE: UPDATE_DISABLE,
+            UPDATE_TOGGLE: UPDATE_FLIP,
+        }[operation]
+        for key in self.field.set_definition._keys:
+            yield key, (state if key in value else UPDATE_KEEP)
+
+    def _has_sql(self, connection, lhs, lhs_params, key):
+        return self.has_all_sql(connection, lhs, lhs_params, self.field.set_definition([key]))
+
+    def _concat_sql(self, connection, parts):
+        if connection.vendor == 'mysql':
+            return 'CONCAT(%s)' % ', '.join(parts)
+        return ' || '.join(parts)
+
+    # Expressions
+
+    def count_sql(self, connection, lhs, lhs_params):
+        """Number of enabled choices, as an integer expression."""
+        parts, params = [], []
+        for key in self.field.set_definition._keys:
+            has_sql, has_params = self._has_sql(connection, lhs, lhs_params, key)
+            parts.append('CASE WHEN %s THEN 1 ELSE 0 END' % has_sql)
+            params.extend(has_params)
+        if not parts:
+            return '0', []
+        return '(%s)' % ' + '.join(parts), params
+
+    # Aggregates
+
+    def choice_counts_sql(self, connection, lhs, lhs_params, condition=None, condition_params=()):
+        """Count rows having each choice, as a comma-separated list of counts in choices order.
+
+        If provided, ``condition`` restricts the counted rows.
+        """
+        parts, params = [], []
+        for key in self.field.set_definition._keys:
+            has_sql, has_params = self._has_sql(connection, lhs, lhs_params, key)
+            if condition is not None:
+                has_sql = '(%s) AND (%s)' % (has_sql, condition)
+                has_params = list(has_params) + list(condition_params)
+            if parts:
+                parts.append("','")
+            parts.append('COUNT(CASE WHEN %s THEN 1 END)' % has_sql)
+            params.extend(has_params)
+        return self._concat_sql(connection, parts), params
+
+
+class TextStorage(BaseStorage):
+    """Store values as a separator-delimited string, e.g. '|spam|eggs|'.
+
+    The separator is added on both sides to ease lookups.
     """
+    name = STORAGE_TEXT
 
-    db_separator = '|'
+    def db_type(self, connection):
+        return 'text'
 
-    def __init__(self, choices, *args, **kwargs):
-        if (isinstance(choices, type) and issubclass(choices, extypes_base.BaseConstrainedSet)):
-            set_definition = choices
-            if hasattr(choices.choices, 'items'):
-                django_choices = list(choices.choices.items())
+    def to_db(self, value):
+        separator = self.field.db_separator
+        return separator.join([''] + list(value or ()) + [''])
+
+    def gin_index_sql(self, connection):
+        if connection.vendor == 'postgresql':
+            return (
+                "CREATE INDEX %%(name)s ON %%(table)s%%(using)s (string_to_array(%%(columns)s, '%s'))%%(extra)s"
+                % self.field.db_separator
+            )
+        return None
+
+    # Lookups: each takes the compiled lhs and a set_definition instance,
+    # and returns a (sql, params) tuple.
+    #
+    # On PostgreSQL, we split the column into an array and use array operators,
+    # which can be backed by a GIN index on ``string_to_array(column, '|')``;
+    # elsewhere, we fall back to one LIKE '%|key|%' per key.
+
+    def _like(self, connection, lhs, lhs_params, key, negate=False):
+        pattern = self.field.db_separator + key + self.field.db_separator
+        sql = '%s %s' % (lhs, connection.operators['contains'] % '%s')
+        if negate:
+            sql = 'NOT (%s)' % sql
+        return sql, list(lhs_params) + ['%%%s%%' % connection.ops.prep_for_like_query(pattern)]
+
+    def _combine_likes(self, connection, lhs, lhs_params, keys, connector, negate=False):
+        if not keys:
+            # Empty AND is true, empty OR is false.
+            return ('1 = 1' if connector == 'AND' else '1 = 0'), []
+        parts = [self._like(connection, lhs, lhs_params, key, negate=negate) for key in keys]
+        sql = (' %s ' % connector).join(part_sql for part_sql, _part_params in parts)
+        params = [param for _part_sql, part_params in parts for param in part_params]
+        return '(%s)' % sql, params
+
+    def _array_op(self, lhs, lhs_params, operator, keys):
+        sql = 'string_to_array(%s, %%s) %s %%s::text[]' % (lhs, operator)
+        return sql, list(lhs_params) + [self.field.db_separator, keys]
+
+    def has_all_sql(self, connection, lhs, lhs_params, value):
+        if connection.vendor == 'postgresql':
+            return self._array_op(lhs, lhs_params, '@>', list(value))
+        return self._combine_likes(connection, lhs, lhs_params, list(value), 'AND')
+
+    def has_any_sql(self, connection, lhs, lhs_params, value):
+        if connection.vendor == 'postgresql':
+            return self._array_op(lhs, lhs_params, '&&', list(value))
+        return self._combine_likes(connection, lhs, lhs_params, list(value), 'OR')
+
+    def subset_of_sql(self, connection, lhs, lhs_params, value):
+        if connection.vendor == 'postgresql':
+            # Stored strings start and end with an empty item.
+            return self._array_op(lhs, lhs_params, '<@', [''] + list(value))
+        return self._combine_likes(connection, lhs, lhs_params, list(~value), 'AND', negate=True)
+
+    def count_sql(self, connection, lhs, lhs_params):
+        if connection.vendor == 'postgresql':
+            # Stored strings start and end with an empty item.
+            sql = 'COALESCE(array_length(string_to_array(%s, %%s), 1) - 2, 0)' % lhs
+            return sql, list(lhs_params) + [self.field.db_separator]
+        return super(TextStorage, self).count_sql(connection, lhs, lhs_params)
+
+    # Updates: each takes the compiled lhs, a set_definition instance and an UPDATE_* operation,
+    # and returns a (sql, params) tuple computing the new column value.
+    #
+    # The value is rebuilt from one CASE per choice, in choices order: stored values
+    # stay identical to those written by get_prep_value().
+
+    def update_sql(self, connection, lhs, lhs_params, value, operation):
+        separator = self.field.db_separator
+        parts, params = ['%s'], [separator]
+        for key, state in self._key_states(value, operation):
+            if state == UPDATE_DISABLE:
+                continue
+            elif state == UPDATE_ENABLE:
+                parts.append('%s')
+                params.append(key + separator)
+            else:
+                has_sql, has_params = self._has_sql(connection, lhs, lhs_params, key)
+                template = "CASE WHEN %s THEN %%s ELSE '' END" if state == UPDATE_KEEP else \
+                    "CASE WHEN %s THEN '' ELSE %%s END"
+                parts.append(template % has_sql)
+                params.extend(has_params + [key + separator])
+        return self._concat_sql(connection, parts), params
+
+
+class BitmaskStorage(BaseStorage):
+    """Store values as an integer bitmask: choice at position i <=> bit i."""
+    name = STORAGE_BITMASK
+
+    # Stored in a signed 64-bits integer.
+    max_choices = 63
+
+    def __init__(self, field):
+        super(BitmaskStorage, self).__init__(field)
+        if len(field.set_definition.choices) > self.max_choices:
+            raise ValueError(
+                "%r storage supports at most %d choices; got %d" % (
+                    self.name, self.max_choices, len(field.set_definition.choices),
+                )
+            )
+
+    def db_type(self, connection):
+        return 'bigint'
+
+    def to_db(self, value):
+        return self.field.to_python(value).to_mask()
+
+    # Lookups
+
+    def _masked(self, connection, lhs, lhs_params, mask, operator, expected):
+        # Parenthesized, so that it can be compared to a boolean, e.g. in filter(has_spam=True).
+        sql = '((%s) %s %%s)' % (connection.ops.combine_expression('&', [lhs, '%s']), operator)
+        return sql, list(lhs_params) + [mask, expected]
+
+    def has_all_sql(self, connection, lhs, lhs_params, value):
+        return self._masked(connection, lhs, lhs_params, value.to_mask(), '=', value.to_mask())
+
+    def has_any_sql(self, connection, lhs, lhs_params, value):
+        return self._masked(connection, lhs, lhs_params, value.to_mask(), '<>', 0)
+
+    def subset_of_sql(self, connection, lhs, lhs_params, value):
+        return self._masked(connection, lhs, lhs_params, (~value).to_mask(), '=', 0)
+
+    def count_sql(self, connection, lhs, lhs_params):
+        if connection.vendor == 'mysql':
+            return 'COALESCE(BIT_COUNT(%s), 0)' % lhs, list(lhs_params)
+        return super(BitmaskStorage, self).count_sql(connection, lhs, lhs_params)
+
+    # Updates
+
+    def update_sql(self, connection, lhs, lhs_params, value, operation):
+        combine = connection.ops.combine_expression
+        if operation == UPDATE_ADD:
+            return combine('|', [lhs, '%s']), list(lhs_params) + [value.to_mask()]
+        elif operation == UPDATE_REMOVE:
+            return combine('&', [lhs, '%s']), list(lhs_params) + [(~value).to_mask()]
+        # XOR, as (lhs | mask) - (lhs & mask): there is no portable XOR operator.
+        sql = '(%s) - (%s)' % (combine('|', [lhs, '%s']), combine('&', [lhs, '%s']))
+        return sql, list(lhs_params) + [value.to_mask()] + list(lhs_params) + [value.to_mask()]
+
+
+class ArrayStorage(TextStorage):
+    """Store values as a varchar[] array on PostgreSQL, e.g. '{spam,eggs}'.
+
+    Other databases fall back to text storage.
+    """
+    name = STORAGE_ARRAY
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'varchar(%d)[]' % max([1] + [len(key) for key in self.field.set_definition.choices])
+        return super(ArrayStorage, self).db_type(connection)
+
+    def to_db(self, value):
+        return list(self.field.to_python(value))
+
+    def get_db_prep_value(self, value, connection):
+        if connection.vendor == 'postgresql':
+            return value
+        return super(ArrayStorage, self).to_db(value)
+
+    def gin_index_sql(self, connection):
+        if connection.vendor == 'postgresql':
+            return "CREATE INDEX %(name)s ON %(table)s%(using)s (%(columns)s)%(extra)s"
+        return super(ArrayStorage, self).gin_index_sql(connection)
+
+    # Lookups
+
+    def _array_op(self, lhs, lhs_params, operator, keys):
+        return '%s %s %%s::varchar[]' % (lhs, operator), list(lhs_params) + [keys]
+
+    def has_all_sql(self, connection, lhs, lhs_params, value):
+        if connection.vendor == 'postgresql':
+            return self._array_op(lhs, lhs_params, '@>', list(value))
+        return super(ArrayStorage, self).has_all_sql(connection, lhs, lhs_params, value)
+
+    def has_any_sql(self, connection, lhs, lhs_params, value):
+        if connection.vendor == 'postgresql':
+            return self._array_op(lhs, lhs_params, '&&', list(value))
+        return super(ArrayStorage, self).has_any_sql(connection, lhs, lhs_params, value)
+
+    def subset_of_sql(self, connection, lhs, lhs_params, value):
+        if connection.vendor == 'postgresql':
+            return self._array_op(lhs, lhs_params, '<@', list(value))
+        return super(ArrayStorage, self).subset_of_sql(connection, lhs, lhs_params, value)
+
+    def count_sql(self, connection, lhs, lhs_params):
+        if connection.vendor == 'postgresql':
+            return 'COALESCE(cardinality(%s), 0)' % lhs, list(lhs_params)
+        return super(ArrayStorage, self).count_sql(connection, lhs, lhs_params)
+
+    # Updates
+
+    def update_sql(self, connection, lhs, lhs_params, value, operation):
+        if connection.vendor != 'postgresql':
+            return super(ArrayStorage, self).update_sql(connection, lhs, lhs_params, value, operation)
+
+        # One item per choice, NULL for disabled ones; then drop the NULLs.
+        parts, params = [], []
+        for key, state in self._key_states(value, operation):
+            if state == UPDATE_DISABLE:
+                continue
+            elif state == UPDATE_ENABLE:
+                parts.append('%s')
+                params.append(key)
             else:
-                django_choices = [(c, c) for c in choices.choices]
+                has_sql, has_params = self._has_sql(connection, lhs, lhs_params, key)
+                template = 'CASE WHEN %s THEN %%s END' if state == UPDATE_KEEP else \
+                    'CASE WHEN %s THEN NULL ELSE %%s END'
+                parts.append(template % has_sql)
+                params.extend(has_params + [key])
+        return 'array_remove(ARRAY[%s]::varchar[], NULL)' % ', '.join(parts), params
+
+
+STORAGES = {
+    STORAGE_TEXT: TextStorage,
+    STORAGE_BITMASK: BitmaskStorage,
+    STORAGE_ARRAY: ArrayStorage,
+}
+
+
+class RawValue(object):
+    """A value read from the database, to be written back as is."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class LazySetAttribute(object):
+    """Model attribute for lazy SetFields.
+
+    Keeps the raw database value in the instance's __dict__ until first access,
+    where it gets parsed into a set_definition instance.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.set_definition = field.set_definition
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        data = instance.__dict__
+        attname = self.field.attname
+        if attname not in data:
+            # Deferred field
+            instance.refresh_from_db(fields=[attname])
+        value = data[attname]
+        if not isinstance(value, self.set_definition):
+            value = data[attname] = self.field.from_raw(value)
+        return value
+
+    def __set__(self, instance, value):
+        if not instance._state.adding:
+            # Loaded from the database: raw values may only come from Model.from_db(),
+            # which runs before _state.adding is cleared.
+            value = self.field.to_python(value)
+        instance.__dict__[self.field.attname] = value
 
+
+class FallbackSetAttribute(LazySetAttribute):
+    """Model attribute for SetFields with a ``fallback`` field.
+
+    While the column is NULL, reading the attribute returns the value of the
+    fallback field, converted to the field's set_definition; it is kept in the
+    instance's __dict__, so that saving the instance stores it.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        data = instance.__dict__
+        attname = self.field.attname
+        if attname not in data:
+            # Deferred field
+            instance.refresh_from_db(fields=[attname])
+        if data[attname] is None:
+            data[attname] = self.set_definition(getattr(instance, self.field.fallback))
+        return super(FallbackSetAttribute, self).__get__(instance, cls)
+
+    def __set__(self, instance, value):
+        if value is None:
+            # Not converted yet.
+            instance.__dict__[self.field.attname] = None
         else:
-            if not is_iterable(choices):
-                raise ValueError("choices must be an iterable of (code, human_readable) tuples; got %r" % (choices,))
+            super(FallbackSetAttribute, self).__set__(instance, value)
+
 
-            for item in choices:
-                if len(item) != 2:
-                    raise ValueError(
-                        "choices must be an iterable of (code, human_readable) tuples; got entry %r in %r"
-                        % (item, choices)
-                    )
+# Resolved SetField choices, by (db_separator, choices); see resolve_choices().
+_resolved_choices = {}
 
-            django_choices = choices
-            set_definition = extypes.ConstrainedSet(collections.OrderedDict(django_choices))
 
-        for opt in set_definition.choices:
-            if self.db_separator in opt:
+def resolve_choices(choices, db_separator):
+    """Validate SetField choices, and build the matching (set_definition, django_choices).
+
+    Results are cached, so that fields declared with the same choices share them
+    without validating again.
+    """
+    is_set_definition = isinstance(choices, type) and issubclass(choices, extypes_base.BaseConstrainedSet)
+    if not is_set_definition:
+        try:
+            choices = tuple(choices)
+        except TypeError:
+            raise ValueError("choices must be an iterable of (code, human_readable) tuples; got %r" % (choices,))
+
+    try:
+        cache_key = (db_separator, choices)
+        return _resolved_choices[cache_key]
+    except TypeError:
+        # Unhashable choices
+        cache_key = None
+    except KeyError:
+        pass
+
+    if is_set_definition:
+        set_definition = choices
+        if hasattr(choices.choices, 'items'):
+            django_choices = list(choices.choices.items())
+        else:
+            django_choices = [(c, c) for c in choices.choices]
+
+    else:
+        django_choices = list(choices)
+        for item in django_choices:
+            if len(item) != 2:
                 raise ValueError(
-                    "%r is forbidden in choices; found in %r" % (self.db_separator, opt)
+                    "choices must be an iterable of (code, human_readable) tuples; got entry %r in %r"
+                    % (item, choices)
                 )
 
+        set_definition = extypes.ConstrainedSet(collections.OrderedDict(django_choices))
+
+    for opt in set_definition.choices:
+        if db_separator in opt:
+            raise ValueError(
+                "%r is forbidden in choices; found in %r" % (db_separator, opt)
+            )
+
+    if cache_key is not None:
+        _resolved_choices[cache_key] = (set_definition, django_choices)
+    return set_definition, django_choices
+
+
+class SetField(models.Field):
+    """A SQL SET field.
+
+    Usage:
+    >>> my_field = extypes.django.SetField(['a', 'b', 'c'])
+
+    Values are stored as text by default; use ``storage=extypes.django.STORAGE_BITMASK``
+    to store them as a BIGINT bitmask instead, or ``storage=extypes.django.STORAGE_ARRAY``
+    for a varchar[] array on PostgreSQL.
+
+    Parsed database values are kept in a per-field LRU cache of ``parse_cache_size``
+    entries (0 to disable).
+
+    With ``lazy=True``, database values are only parsed when the model attribute
+    is first accessed, and written back untouched if it never was.
+    In that mode, ``QuerySet.values()`` returns the raw database values.
+
+    With ``fallback='other_field'`` (and ``null=True``), the model attribute reads
+    other_field's value while the column is NULL: this allows moving values to a
+    new column progressively; see convert_set_field().
+    """
+
+    db_separator = '|'
+    default_parse_cache_size = 256
+
+    def __init__(self, choices, *args, **kwargs):
+        storage = kwargs.pop('storage', STORAGE_TEXT)
+        self.parse_cache_size = kwargs.pop('parse_cache_size', self.default_parse_cache_size)
+        self.lazy = kwargs.pop('lazy', False)
+        self.fallback = kwargs.pop('fallback', None)
+        if storage not in STORAGES:
+            raise ValueError("storage must be one of %s; got %r" % (sorted(STORAGES), storage))
+        if self.fallback is not None and not kwargs.get('null'):
+            raise ValueError("fallback requires null=True; got fallback=%r" % (self.fallback,))
+
+        set_definition, django_choices = resolve_choices(choices, self.db_separator)
         self.django_choices = django_choices
         self.set_definition = set_definition
-        kwargs['max_length'] = len(self.get_prep_value(set_definition.choices))
+        self.storage = STORAGES[storage](self)
+        if self.storage.name == STORAGE_TEXT:
+            # Length of get_prep_value(set_definition.choices), e.g. '|a|b|'
+            kwargs['max_length'] = len(self.db_separator) * (len(set_definition._keys) + 1) + sum(
+                len(key) for key in set_definition._keys
+            )
         super(SetField, self).__init__(*args, **kwargs)
 
     def to_python(self, value):
         if isinstance(value, self.set_definition):
             return value
+        elif isinstance(value, compat.text_type):
+            # Database or serialized value: go through the parse cache.
+            return self.from_raw(value)
+        return self.set_definition._from_mask(self._parse(value))
 
+    def _parse(self, value):
+        """Parse a raw or serialized value into a mask."""
         if value in (None, '', b''):
             value = ()
 
-        if isinstance(value, six.text_type):
+        if isinstance(value, compat.integer_types):
+            return self.set_definition.from_mask(value)._mask
+
+        if isinstance(value, compat.text_type):
             value = value.split(self.db_separator)
 
         # Remove empty options
         value = [opt for opt in value if opt.strip()]
 
-        return self.set_definition(value)
+        return self.set_definition._mask_from(value)
+
+    def _format(self, mask):
+        """Format a mask as a serialized value."""
+        return self.db_separator.join(self.set_definition._from_mask(mask)._iter_keys())
+
+    def _memoize(self, func):
+        if self.parse_cache_size:
+            return functools.lru_cache(maxsize=self.parse_cache_size)(func)
+        return func
+
+    # Per-field caches, built on first use.
+
+    @cached_property
+    def _parse_mask(self):
+        """Parse a (hashable) raw database value into a mask; memoized per field."""
+        return self._memoize(self._parse)
+
+    @cached_property
+    def _format_mask(self):
+        """Format a mask for serialization; memoized per field."""
+        return self._memoize(self._format)
 
     def from_db_value(self, value, expression, connection, context):
         """Convert from the database format.
 
         This should be the inverse of self.get_prep_value()
         """
+        if value is None and self.fallback is not None:
+            # Not converted yet: see FallbackSetAttribute.
+            return None
+        return self.from_raw(value)
+
+    def from_raw(self, value):
+        """Parse a raw database value.
+
+        Since few distinct values are stored, we cache the parsed mask, and build
+        a fresh (mutable) instance from it for each row.
+        """
+        if isinstance(value, compat.text_type):
+            return self.set_definition._from_mask(self._parse_mask(value))
+        elif isinstance(value, list):
+            return self.set_definition._from_mask(self._parse_mask(tuple(value)))
         return self.to_python(value)
 
-    def db_type(self, connection):
-        """Storage in the database.
+    def raw_to_string(self, value):
+        """Serialize a raw database value, as value_to_string() would, without building a set."""
+        if isinstance(value, list):
+            value = tuple(value)
+        return self._format_mask(self._parse_mask(value))
+
+    def value_to_string(self, obj):
+        """Serialize the field's value on obj, for the serialization framework.
 
-        Should go for more efficient options, though.
+        Enabled keys are joined with self.db_separator, in choices order: 'spam|eggs'.
         """
-        return 'text'
+        return self._format_mask(self.to_python(self.value_from_object(obj))._mask)
+
+    def get_db_converters(self, connection):
+        if self.lazy:
+            # Parsing happens in LazySetAttribute.
+            return []
+        return super(SetField, self).get_db_converters(connection)
+
+    def db_type(self, connection):
+        """Storage in the database; see self.storage."""
+        return self.storage.db_type(connection)
 
     def get_prep_value(self, value):
-        """Convert to a simple, serializable string.
+        """Convert to a simple, serializable value.
 
         Used for databases and serializers.
 
-        We add self.db_separator on both sides to ease lookups.
+        With the default text storage, we add self.db_separator on both sides to ease lookups.
         """
-        return self.db_separator.join([''] + list(value or ()) + [''])
+        if value is None and self.fallback is not None:
+            # Not converted yet: see FallbackSetAttribute.
+            return None
+        return self.storage.to_db(value)
+
+    def pre_save(self, model_instance, add):
+        if self.fallback is not None and model_instance.__dict__.get(self.attname) is None:
+            # Not converted yet: store the fallback field's value.
+            getattr(model_instance, self.attname)
+        if not self.lazy:
+            return super(SetField, self).pre_save(model_instance, add)
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, self.set_definition):
+            return value
+        elif model_instance._state.adding:
+            # Not loaded from the database: normalize
+            value = self.to_python(value)
+            setattr(model_instance, self.attname, value)
+            return value
+        return RawValue(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, RawValue):
+            return value.value
+        if not prepared:
+            value = self.get_prep_value(value)
+        return self.storage.get_db_prep_value(value, connection)
 
     def get_display(self, value):
         """Display pretty-printer."""
@@ -110,8 +646,10 @@ class SetField(models.Field):
         """Contribute to the Model subclass.
 
         We set our custom get_FIELD_display(),
-        which returns a comma-separated list of displays; and
-        add a "set_definition" attribute to the class-level attribute descriptor.
+        which returns a comma-separated list of displays;
+        install a LazySetAttribute descriptor for lazy fields (FallbackSetAttribute
+        for fields with a fallback); and add a "set_definition" attribute to the
+        class-level attribute descriptor.
         """
         super(SetField, self).contribute_to_class(cls, name, **kwargs)
 
@@ -119,6 +657,11 @@ class SetField(models.Field):
             from django.db.models.fields import subclassing
             setattr(cls, self.name, subclassing.Creator(self))
 
+        if self.fallback is not None:
+            setattr(cls, self.attname, FallbackSetAttribute(self))
+        elif self.lazy:
+            setattr(cls, self.attname, LazySetAttribute(self))
+
         cls_attr = getattr(cls, self.name, None)
         if django.VERSION[:2] < (1, 10) and cls_attr is None:
             cls_attr = type(str(self.attname), (object,), {'set_definition': self.set_definition})
@@ -138,6 +681,7 @@ class SetField(models.Field):
         We'll use a TypedMultipleChoiceField, and reinject the django-formatted
         choices.
         """
+        from django.forms import fields as forms_fields
         defaults = {
             'choices': self.django_choices,
             'form_class': forms_fields.TypedMultipleChoiceField,
@@ -148,6 +692,357 @@ class SetField(models.Field):
 
     def deconstruct(self):
         name, path, args, kwargs = super(SetField, self).deconstruct()
-        del kwargs['max_length']
+        kwargs.pop('max_length', None)
+        if self.storage.name != STORAGE_TEXT:
+            kwargs['storage'] = self.storage.name
+        if self.fallback is not None:
+            kwargs['fallback'] = self.fallback
         kwargs['choices'] = [(key, key) for key in self.set_definition.choices]
         return name, path, args, kwargs
+
+
+def export_values_list(queryset, *fields):
+    """Iterate over ``queryset.values_list(*fields)``, with SetField values serialized as by value_to_string().
+
+    Usage:
+    >>> for pk, contents in export_values_list(Fridge.objects.all(), 'pk', 'contents'):
+    ...     writer.writerow([pk, contents])
+
+    SetField columns are fetched as raw database values, skipping the field's
+    converters: neither models nor sets are built, and each distinct raw value
+    is only converted once (see SetField.parse_cache_size).
+    """
+    from django.core.exceptions import FieldDoesNotExist
+
+    raw_fields = {}
+    for name in fields:
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if isinstance(field, SetField):
+            raw_fields[name] = field
+
+    queryset = queryset.annotate(**dict(
+        ('extypes_raw_%s' % name, models.ExpressionWrapper(models.F(name), output_field=models.Field()))
+        for name in raw_fields
+    ))
+    rows = queryset.values_list(*[('extypes_raw_%s' % name if name in raw_fields else name) for name in fields])
+    converters = [
+        (index, raw_fields[name].raw_to_string) for index, name in enumerate(fields) if name in raw_fields
+    ]
+    for row in rows:
+        row = list(row)
+        for index, converter in converters:
+            row[index] = converter(row[index])
+        yield tuple(row)
+
+
+def convert_set_field(queryset, from_field, to_field, batch_size=1000, progress=None):
+    """Copy values of a SetField into another SetField of the same model, in batches.
+
+    Usage:
+    >>> convert_set_field(Fridge.objects.all(), 'flags', 'flags_bitmask', batch_size=1000)
+
+    Only rows where to_field is NULL are converted: the target is expected to
+    be a nullable field, typically with ``fallback=from_field``.
+    Each batch of at most ``batch_size`` rows is converted in its own
+    transaction, locking only its rows; an interrupted conversion resumes
+    where it stopped when called again.
+    If provided, ``progress(converted, last_pk)`` is called after each batch.
+
+    Returns the number of converted rows.
+    """
+    from django.db import router, transaction
+
+    target = queryset.model._meta.get_field(to_field)
+    using = queryset._db or router.db_for_write(queryset.model)
+    pending = queryset.using(using).filter(**{'%s__isnull' % to_field: True}).order_by('pk')
+    converted = 0
+    last_pk = None
+    while True:
+        with transaction.atomic(using=using):
+            batch = pending if last_pk is None else pending.filter(pk__gt=last_pk)
+            pks = list(batch.select_for_update().values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return converted
+
+            # Few distinct values are stored: update rows by value.
+            pks_by_value = collections.OrderedDict()
+            for pk, value in export_values_list(pending.filter(pk__in=pks), 'pk', from_field):
+                pks_by_value.setdefault(value, []).append(pk)
+            for value, value_pks in pks_by_value.items():
+                converted += pending.filter(pk__in=value_pks).update(**{to_field: target.to_python(value)})
+        last_pk = pks[-1]
+        if progress is not None:
+            progress(converted, last_pk)
+
+
+def _field_label(field):
+    """Owner label of a SetField in extypes.instrumentation: 'app_label.Model.field'."""
+    model = getattr(field, 'model', None)
+    if model is None:
+        return field.name or field.__class__.__name__
+    return '%s.%s' % (model._meta.label, field.name)
+
+
+def _cache_counters():
+    """Hits and misses of the SetField caches, for extypes.instrumentation."""
+    from django.apps import apps
+
+    for model in apps.get_models():
+        for field in model._meta.local_fields:
+            if not isinstance(field, SetField):
+                continue
+            for attribute, name in (('_parse_mask', 'parse_cache'), ('_format_mask', 'format_cache')):
+                # Only report caches which have been built.
+                cache_info = getattr(field.__dict__.get(attribute), 'cache_info', None)
+                if cache_info is not None:
+                    info = cache_info()
+                    yield _field_label(field), '%s_hits' % name, info.hits
+                    yield _field_label(field), '%s_misses' % name, info.misses
+
+
+instrumentation.register(SetField, ['to_python', 'get_prep_value', 'from_db_value', 'from_raw'], owner=_field_label)
+instrumentation.registry.add_collector(_cache_counters)
+
+
+class SetFieldGinIndex(models.Index):
+    """A GIN index on a SetField, serving its lookups on PostgreSQL.
+
+    Usage:
+    >>> class Meta:
+    ...     indexes = [SetFieldGinIndex(fields=['contents'], name='fridge_contents_gin')]
+
+    For text storage, the index is built on ``string_to_array(column, '|')``.
+    On other databases, or with bitmask storage, a standard index is created instead.
+    """
+    suffix = 'gin'
+
+    def __init__(self, *args, **kwargs):
+        super(SetFieldGinIndex, self).__init__(*args, **kwargs)
+        if len(self.fields) != 1:
+            raise ValueError("SetFieldGinIndex requires a single field; got %r" % (self.fields,))
+
+    def create_sql(self, model, schema_editor, using=''):
+        field = model._meta.get_field(self.fields[0])
+        sql = field.storage.gin_index_sql(schema_editor.connection)
+        if sql is None:
+            return super(SetFieldGinIndex, self).create_sql(model, schema_editor, using=using)
+        if django.VERSION[:2] < (2, 0):
+            # No db_tablespace, and no name / using arguments to _create_index_sql() before Django 2.0.
+            return sql % self.get_sql_create_template_values(model, schema_editor, using=' USING gin')
+        return schema_editor._create_index_sql(
+            model, [field], name=self.name, using=' USING gin', db_tablespace=self.db_tablespace, sql=sql,
+        )
+
+
+class SetLookup(models.Lookup):
+    """Base class for SetField lookups.
+
+    The SQL is generated by the field's storage, through its ``<sql_method>``.
+    """
+    sql_method = None
+    prepare_rhs = False
+
+    def get_prep_lookup(self):
+        if hasattr(self.rhs, 'resolve_expression'):
+            raise ValueError("Lookup %r doesn't support expressions; got %r" % (self.lookup_name, self.rhs))
+        return self.prepare_set(self.lhs.output_field, self.rhs)
+
+    def prepare_set(self, field, value):
+        """Convert the lookup value to a set_definition instance."""
+        return field.to_python(value)
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        storage = self.lhs.output_field.storage
+        return getattr(storage, self.sql_method)(connection, lhs, lhs_params, self.rhs)
+
+
+@SetField.register_lookup
+class HasLookup(SetLookup):
+    """field__has='a': the key is enabled."""
+    lookup_name = 'has'
+    sql_method = 'has_all_sql'
+
+    def prepare_set(self, field, value):
+        return field.set_definition([value])
+
+
+@SetField.register_lookup
+class HasAllLookup(SetLookup):
+    """field__has_all=['a', 'b']: all keys are enabled."""
+    lookup_name = 'has_all'
+    sql_method = 'has_all_sql'
+
+
+@SetField.register_lookup
+class HasAnyLookup(SetLookup):
+    """field__has_any=['a', 'b']: at least one of the keys is enabled."""
+    lookup_name = 'has_any'
+    sql_method = 'has_any_sql'
+
+
+@SetField.register_lookup
+class SubsetOfLookup(SetLookup):
+    """field__subset_of=['a', 'b']: no other key is enabled."""
+    lookup_name = 'subset_of'
+    sql_method = 'subset_of_sql'
+
+
+class SetExpression(models.Expression):
+    """Base class for expressions over a SetField and some of its keys.
+
+    ``value`` holds the keys as a set_definition instance, once resolved.
+    """
+
+    def __init__(self, expression, *keys, **extra):
+        super(SetExpression, self).__init__(**extra)
+        if isinstance(expression, compat.string_types):
+            expression = models.F(expression)
+        self.lhs = expression
+        self.keys = keys
+        self.value = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(repr(arg) for arg in (self.lhs,) + self.keys))
+
+    @property
+    def set_field(self):
+        return self.lhs.output_field
+
+    def get_source_expressions(self):
+        return [self.lhs]
+
+    def set_source_expressions(self, exprs):
+        self.lhs, = exprs
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        c = super(SetExpression, self).resolve_expression(query, allow_joins, reuse, summarize, for_save)
+        if not isinstance(c.set_field, SetField):
+            raise TypeError("%s requires a SetField; got %r" % (self.__class__.__name__, c.set_field))
+        c.value = c.set_field.set_definition(c.keys)
+        return c
+
+
+class SetHas(SetExpression):
+    """SetHas('field', 'a', 'b'): whether all keys are enabled, as a boolean.
+
+    Usage:
+    >>> Fridge.objects.annotate(online=SetHas('flags', 'online')).order_by('-online', 'pk')
+
+    The SQL is generated by the field's storage, through its ``has_all_sql()``.
+    """
+    output_field = models.BooleanField()
+    # Allows use as a When() condition.
+    conditional = True
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = compiler.compile(self.lhs)
+        sql, params = self.set_field.storage.has_all_sql(connection, lhs, lhs_params, self.value)
+        return '(%s)' % sql, params
+
+
+class SetCount(SetExpression):
+    """SetCount('field'): the number of enabled keys, as an integer.
+
+    Usage:
+    >>> Fridge.objects.annotate(flag_count=SetCount('flags')).order_by('-flag_count')
+
+    The SQL is generated by the field's storage, through its ``count_sql()``.
+    """
+    output_field = models.IntegerField()
+
+    def __init__(self, expression, **extra):
+        super(SetCount, self).__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = compiler.compile(self.lhs)
+        return self.set_field.storage.count_sql(connection, lhs, lhs_params)
+
+
+class SetUpdate(SetExpression):
+    """Base class for SetField update expressions, for use in ``QuerySet.update()``.
+
+    Usage:
+    >>> Fridge.objects.filter(contents__has='spam').update(flags=SetAdd('flags', 'online'))
+
+    The SQL is generated by the field's storage, through its ``update_sql()``.
+    """
+    operation = None
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        c = super(SetUpdate, self).resolve_expression(query, allow_joins, reuse, summarize, for_save)
+        if c.set_field.fallback is not None:
+            # Unconverted rows are NULL: the update would compute NULL, and keep reading the fallback.
+            raise TypeError(
+                "%s can't update %s, which has fallback=%r; convert its values first (see convert_set_field())."
+                % (self.__class__.__name__, c.set_field.name, c.set_field.fallback)
+            )
+        return c
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = compiler.compile(self.lhs)
+        return self.set_field.storage.update_sql(connection, lhs, lhs_params, self.value, self.operation)
+
+
+class SetAdd(SetUpdate):
+    """SetAdd('field', 'a', 'b'): enable keys."""
+    operation = UPDATE_ADD
+
+
+class SetRemove(SetUpdate):
+    """SetRemove('field', 'a', 'b'): disable keys."""
+    operation = UPDATE_REMOVE
+
+
+class SetToggle(SetUpdate):
+    """SetToggle('field', 'a', 'b'): enable disabled keys, and disable enabled ones."""
+    operation = UPDATE_TOGGLE
+
+
+class SetChoiceCounts(models.Aggregate):
+    """Count rows having each choice of a SetField.
+
+    Usage:
+    >>> Fridge.objects.aggregate(counts=SetChoiceCounts('flags'))
+    {'counts': OrderedDict([('clean', 3), ('online', 12), ('open', 0)])}
+
+    The counts are computed by the field's storage, through its ``choice_counts_sql()``.
+    """
+    name = 'SetChoiceCounts'
+    output_field = models.TextField()
+
+    def __init__(self, expression, **extra):
+        if 'filter' in extra and django.VERSION[:2] < (2, 0):
+            # Aggregate(filter=...) was added in Django 2.0: it would be silently ignored.
+            raise TypeError("%s(filter=...) requires Django 2.0 or later." % self.__class__.__name__)
+        super(SetChoiceCounts, self).__init__(expression, **extra)
+
+    @property
+    def set_field(self):
+        return self.source_expressions[0].output_field
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        c = super(SetChoiceCounts, self).resolve_expression(query, allow_joins, reuse, summarize, for_save)
+        if not isinstance(c.set_field, SetField):
+            raise TypeError("%s requires a SetField; got %r" % (self.__class__.__name__, c.set_field))
+        return c
+
+    def as_sql(self, compiler, connection, **extra_context):
+        lhs, lhs_params = compiler.compile(self.source_expressions[0])
+        condition, condition_params = None, ()
+        # No filter attribute before Django 2.0.
+        if getattr(self, 'filter', None):
+            condition, condition_params = compiler.compile(self.filter)
+        return self.set_field.storage.choice_counts_sql(connection, lhs, lhs_params, condition, condition_params)
+
+    def convert_value(self, value, expression, connection, *args):
+        # *args: the context argument, before Django 2.0.
+        keys = self.set_field.set_definition._keys
+        if value is None:
+            # Empty queryset (e.g. pk__in=[]): Django doesn't run the query.
+            return collections.OrderedDict((key, 0) for key in keys)
+        counts = [int(count) for count in value.split(',')]
+        return collections.OrderedDict(zip(keys, counts))
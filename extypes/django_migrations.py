@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+"""Migration operations for extypes.django.SetField.
+
+Kept apart from extypes.django, which shouldn't import the migrations framework.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+from django.db.migrations.operations.base import Operation
+
+from extypes import django as extypes_django
+
+
+class ConvertSetField(Operation):
+    """Copy values of a SetField into another one, in batches; see extypes.django.convert_set_field().
+
+    Usage, in a migration with ``atomic = False``:
+    >>> operations = [ConvertSetField('fridge', 'flags', 'flags_bitmask', batch_size=1000)]
+
+    This doesn't alter the schema: the target field is expected to be nullable,
+    typically with ``fallback=from_field``, and added by a previous migration.
+    In a non-atomic migration, each batch is committed separately: running the
+    migration again after an interruption resumes the conversion.
+    Reverting the operation is a no-op.
+    """
+
+    reduces_to_sql = False
+    reversible = True
+
+    def __init__(self, model_name, from_field, to_field, batch_size=1000):
+        self.model_name = model_name
+        self.from_field = from_field
+        self.to_field = to_field
+        self.batch_size = batch_size
+
+    def deconstruct(self):
+        kwargs = {}
+        if self.batch_size != 1000:
+            kwargs['batch_size'] = self.batch_size
+        return (self.__class__.__name__, [self.model_name, self.from_field, self.to_field], kwargs)
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        alias = schema_editor.connection.alias
+        if self.allow_migrate_model(alias, model):
+            extypes_django.convert_set_field(
+                model._default_manager.using(alias), self.from_field, self.to_field, batch_size=self.batch_size,
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        pass
+
+    def describe(self):
+        return "Convert %s.%s into %s" % (self.model_name, self.from_field, self.to_field)
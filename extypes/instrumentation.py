@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+"""Opt-in profiling of constrained sets and SetField.
+
+Usage:
+>>> import extypes
+>>> from extypes import instrumentation
+>>> Foods = extypes.ConstrainedSet(['eggs', 'spam', 'bacon'], name='Foods')
+>>> instrumentation.enable()
+>>> Foods(['spam']) | Foods(['eggs'])
+>>> instrumentation.registry.snapshot()['timings'][('Foods[c1c5f88e]', 'union')]
+(1, 2.1e-06)
+>>> print(instrumentation.registry.dump())
+extypes_calls_total{owner="Foods[c1c5f88e]",operation="union"} 1
+extypes_seconds_total{owner="Foods[c1c5f88e]",operation="union"} 0.000002
+...
+
+Instrumented methods are declared with register(), and only wrapped while
+instrumentation is enabled: once disabled, the original methods are restored,
+so that disabled instrumentation has no overhead at all.
+
+Calls are recorded by owner (the constrained set class name and fingerprint,
+or the ``app_label.Model.field`` label of a SetField) and operation (the method name).
+Timings are inclusive: a method calling another instrumented method is
+charged for both.
+"""
+
+from __future__ import unicode_literals
+
+import functools
+import threading
+import time
+
+
+class Registry(object):
+    """Collects the number of calls and cumulative time of instrumented operations.
+
+    Collectors, added through add_collector(), provide extra counters when
+    taking a snapshot; e.g. cache statistics.
+    """
+
+    def __init__(self):
+        self._timings = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def record(self, owner, operation, seconds):
+        key = (owner, operation)
+        with self._lock:
+            calls, total = self._timings.get(key, (0, 0.0))
+            self._timings[key] = (calls + 1, total + seconds)
+
+    def add_collector(self, collector):
+        """Add a callable returning an iterable of (owner, counter name, value)."""
+        self._collectors.append(collector)
+
+    def reset(self):
+        """Forget recorded timings."""
+        with self._lock:
+            self._timings.clear()
+
+    def snapshot(self):
+        """Current statistics, as a dict with two entries.
+
+        - 'timings' maps (owner, operation) to (calls, cumulative seconds);
+        - 'counters' maps (owner, counter name) to the value from collectors.
+        """
+        with self._lock:
+            timings = dict(self._timings)
+        counters = {}
+        for collector in self._collectors:
+            for owner, name, value in collector():
+                counters[(owner, name)] = value
+        return {'timings': timings, 'counters': counters}
+
+    def dump(self):
+        """Current statistics, in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for metric, index, fmt in (('extypes_calls_total', 0, '%d'), ('extypes_seconds_total', 1, '%.6f')):
+            lines.append('# TYPE %s counter' % metric)
+            for (owner, operation), values in sorted(snapshot['timings'].items()):
+                lines.append('%s{owner="%s",operation="%s"} %s' % (
+                    metric, _escape(owner), _escape(operation), fmt % values[index],
+                ))
+        for (owner, name), value in sorted(snapshot['counters'].items()):
+            lines.append('extypes_%s{owner="%s"} %d' % (name, _escape(owner), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(label):
+    return label.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The default registry.
+registry = Registry()
+
+
+def class_name(target):
+    """Owner of an instance or class method: the name of the class."""
+    return target.__name__ if isinstance(target, type) else target.__class__.__name__
+
+
+def _instrument(func, operation, owner):
+    record = registry.record
+    timer = time.perf_counter
+
+    @functools.wraps(func)
+    def wrapper(target, *args, **kwargs):
+        start = timer()
+        try:
+            return func(target, *args, **kwargs)
+        finally:
+            record(owner(target), operation, timer() - start)
+    return wrapper
+
+
+# Methods to instrument, as (class, method names, owner function).
+_targets = []
+
+# Original methods of instrumented classes, by (class, method name); non-empty iff enabled.
+_originals = {}
+
+_enabled = False
+
+
+def _patch(cls, names, owner):
+    for name in names:
+        original = cls.__dict__[name]
+        if isinstance(original, (classmethod, staticmethod)):
+            wrapped = type(original)(_instrument(original.__func__, name, owner))
+        else:
+            wrapped = _instrument(original, name, owner)
+        _originals[(cls, name)] = original
+        setattr(cls, name, wrapped)
+
+
+def register(cls, names, owner=class_name):
+    """Declare methods of cls to instrument while instrumentation is enabled.
+
+    owner(target) returns the owner label for a call, from the instance or class
+    the method was called on.
+    """
+    _targets.append((cls, tuple(names), owner))
+    if _enabled:
+        _patch(cls, names, owner)
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable():
+    """Start recording calls to registered methods."""
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    for cls, names, owner in _targets:
+        _patch(cls, names, owner)
+
+
+def disable():
+    """Stop recording, restoring the original methods; recorded statistics are kept."""
+    global _enabled
+    if not _enabled:
+        return
+    _enabled = False
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
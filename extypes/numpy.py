@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+
+from __future__ import absolute_import, unicode_literals
+
+import numpy
+
+from extypes import base as extypes_base
+from extypes import representations as extypes_representations
+
+"""extypes-based vectorized columns, backed by numpy."""
+
+
+# Popcount for each possible byte value.
+_BYTE_POPCOUNT = numpy.array([bin(i).count('1') for i in range(256)], dtype=numpy.uint8)
+
+
+def mask_dtype(set_definition):
+    """The smallest unsigned integer dtype able to hold a mask of the given set class."""
+    if set_definition._representation != extypes_representations.BITMASK:
+        raise ValueError(
+            "ConstrainedSetArray requires the %r representation; %s uses %r."
+            % (extypes_representations.BITMASK, set_definition.__name__, set_definition._representation)
+        )
+    size = len(set_definition._keys)
+    for dtype in (numpy.uint8, numpy.uint16, numpy.uint32, numpy.uint64):
+        if size <= numpy.iinfo(dtype).bits:
+            return numpy.dtype(dtype)
+    raise ValueError(
+        "ConstrainedSetArray supports at most 64 choices; %s has %d." % (set_definition.__name__, size)
+    )
+
+
+class ConstrainedSetArray(object):
+    """A column of ConstrainedSet values, stored as a numpy array of bitmasks.
+
+    Usage:
+    >>> Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'])
+    >>> column = ConstrainedSetArray.from_sets(Foods, [['spam'], ['eggs', 'bacon'], []])
+    >>> column.contains('spam')
+    array([ True, False, False])
+
+    Operations accept, as their "other" argument, either another
+    ConstrainedSetArray of the same length (element-wise operation),
+    or a single set instance / iterable of keys (broadcast to all rows).
+    """
+
+    def __init__(self, set_definition, masks):
+        self.set_definition = set_definition
+        self.dtype = mask_dtype(set_definition)
+        self.masks = numpy.asarray(masks, dtype=self.dtype)
+
+    @classmethod
+    def from_sets(cls, set_definition, values):
+        """Build from an iterable of set instances or iterables of keys."""
+        dtype = mask_dtype(set_definition)
+        masks = numpy.fromiter((set_definition._mask_from(value) for value in values), dtype=dtype)
+        return cls(set_definition, masks)
+
+    def to_sets(self):
+        """Convert back to a list of set_definition instances."""
+        from_mask = self.set_definition._from_mask
+        return [from_mask(mask) for mask in self.masks.tolist()]
+
+    def _new(self, masks):
+        return self.__class__(self.set_definition, masks)
+
+    def _other_masks(self, other):
+        """Convert an operand to an array (or scalar) of masks."""
+        if isinstance(other, ConstrainedSetArray):
+            if other.set_definition._keys != self.set_definition._keys:
+                raise TypeError("Can't combine %r and %r" % (self, other))
+            if len(other) != len(self):
+                raise ValueError("Can't combine arrays of lengths %d and %d" % (len(self), len(other)))
+            return other.masks
+        if isinstance(other, extypes_base.AbstractConstrainedSet) and other._keys != self.set_definition._keys:
+            raise TypeError("Can't combine %r and %r" % (self, other))
+        return self.dtype.type(self.set_definition._mask_from(other))
+
+    # Container
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __iter__(self):
+        return iter(self.to_sets())
+
+    def __getitem__(self, index):
+        masks = self.masks[index]
+        if isinstance(masks, numpy.ndarray):
+            return self._new(masks)
+        return self.set_definition._from_mask(int(masks))
+
+    def __repr__(self):
+        return '%s(%s, %d rows)' % (self.__class__.__name__, self.set_definition.__name__, len(self))
+
+    # Per-row tests; all return boolean arrays.
+
+    def contains(self, key):
+        bit = self.dtype.type(self.set_definition._bit(key))
+        return (self.masks & bit) != 0
+
+    def equals(self, other):
+        return self.masks == self._other_masks(other)
+
+    def isdisjoint(self, other):
+        return (self.masks & self._other_masks(other)) == 0
+
+    def issubset(self, other):
+        return (self.masks & ~self._other_masks(other)) == 0
+
+    def issuperset(self, other):
+        return (~self.masks & self._other_masks(other)) == 0
+
+    def popcount(self):
+        """Number of enabled choices in each row."""
+        if hasattr(numpy, 'bitwise_count'):
+            return numpy.bitwise_count(self.masks)
+        # Views on other dtypes require contiguous data, e.g. not column[::2].
+        as_bytes = numpy.ascontiguousarray(self.masks).view(numpy.uint8).reshape(len(self.masks), self.dtype.itemsize)
+        return _BYTE_POPCOUNT[as_bytes].sum(axis=1, dtype=numpy.uint8)
+
+    # Combination; all return a new ConstrainedSetArray.
+
+    def union(self, other):
+        return self._new(self.masks | self._other_masks(other))
+
+    def intersection(self, other):
+        return self._new(self.masks & self._other_masks(other))
+
+    def difference(self, other):
+        return self._new(self.masks & ~self._other_masks(other))
+
+    def symmetric_difference(self, other):
+        return self._new(self.masks ^ self._other_masks(other))
+
+    def __invert__(self):
+        return self._new(~self.masks & self.dtype.type(self.set_definition._full_mask))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
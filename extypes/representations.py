@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+
+from __future__ import unicode_literals
+
+import array
+import bisect
+
+from . import compat
+
+"""Alternative mask representations, for constrained sets over large universes.
+
+By default, constrained sets store their enabled choices as an integer bitmask,
+whose size grows with the number of choices. The masks defined here keep the
+cost of a value proportional to its contents instead:
+
+- SparseMask stores a sorted array of positions;
+- ChunkedMask stores CHUNK_BITS-wide bitmasks, skipping empty chunks.
+
+Both store the disabled positions instead when more than half of the choices
+are enabled, so that dense values stay small too.
+
+Masks are immutable, and provide the part of the integer interface used by
+constrained sets: ``|``, ``&``, ``^``, ``~`` (within the universe), ``bool()``,
+``==`` and ``hash()``.
+"""
+
+
+BITMASK = 'bitmask'
+SPARSE = 'sparse'
+CHUNKED = 'chunked'
+
+REPRESENTATIONS = (BITMASK, SPARSE, CHUNKED)
+
+
+def _int_to_positions(mask):
+    """Positions of the bits set in a non-negative integer, in increasing order."""
+    data = bytearray(mask.to_bytes((mask.bit_length() + 7) // 8, 'little'))
+    for index, byte in enumerate(data):
+        while byte:
+            lowest = byte & -byte
+            yield index * 8 + lowest.bit_length() - 1
+            byte ^= lowest
+
+
+def _positions_to_int(positions, size):
+    """Integer with the bits at the given positions set."""
+    data = bytearray((size + 7) // 8)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bytes(data), 'little')
+
+
+class ComplementableMask(object):
+    """A set of positions in range(size), stored as either its positions or their complement.
+
+    ``items`` holds the stored positions, in a subclass-specific container
+    handled by the ``_items_*`` methods; if ``complemented``, they are the
+    disabled positions.
+    Instances are normalized by _build(), so that equal masks have equal items.
+    """
+    __slots__ = ('items', 'complemented', 'size')
+
+    def __init__(self, items, complemented, size):
+        self.items = items
+        self.complemented = complemented
+        self.size = size
+
+    @classmethod
+    def _build(cls, items, complemented, size):
+        """Build a mask, storing whichever of the enabled or disabled positions is smaller."""
+        count = cls._items_count(items)
+        enabled = size - count if complemented else count
+        should_complement = enabled > size // 2
+        if should_complement != complemented:
+            items = cls._items_complement(items, size)
+        return cls(items, should_complement, size)
+
+    # Constructors
+
+    @classmethod
+    def empty(cls, size):
+        return cls._build(cls._items_from_positions(()), False, size)
+
+    @classmethod
+    def full(cls, size):
+        return cls._build(cls._items_from_positions(()), True, size)
+
+    @classmethod
+    def from_positions(cls, positions, size):
+        return cls._build(cls._items_from_positions(sorted(set(positions))), False, size)
+
+    @classmethod
+    def from_int(cls, mask, size):
+        return cls._build(cls._items_from_positions(list(_int_to_positions(mask))), False, size)
+
+    def to_int(self):
+        mask = self._items_to_int(self.items, self.size)
+        if self.complemented:
+            mask ^= (1 << self.size) - 1
+        return mask
+
+    # Serialization: a flag byte (1 if the stored positions are the disabled ones),
+    # then the gaps between stored positions, as unsigned LEB128 integers.
+
+    def to_bytes(self):
+        data = bytearray([1 if self.complemented else 0])
+        previous = -1
+        for position in self._items_iter(self.items):
+            gap = position - previous - 1
+            while gap >= 0x80:
+                data.append(0x80 | (gap & 0x7f))
+                gap >>= 7
+            data.append(gap)
+            previous = position
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data, size):
+        data = bytearray(data)
+        if not data or data[0] > 1:
+            raise ValueError("Invalid %s data: missing flag byte." % cls.__name__)
+        positions = []
+        position, gap, shift = -1, 0, 0
+        for byte in data[1:]:
+            gap |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                shift += 7
+                continue
+            position += gap + 1
+            positions.append(position)
+            gap, shift = 0, 0
+        if shift:
+            raise ValueError("Invalid %s data: truncated position." % cls.__name__)
+        if position >= size:
+            raise ValueError("Invalid %s data: position %d out of range(%d)." % (cls.__name__, position, size))
+        return cls._build(cls._items_from_positions(positions), bool(data[0]), size)
+
+    # Reading
+
+    def iter_positions(self):
+        """Iterate over enabled positions, in increasing order."""
+        if not self.complemented:
+            return self._items_iter(self.items)
+        return self._iter_complement()
+
+    def _iter_complement(self):
+        position = 0
+        for disabled in self._items_iter(self.items):
+            for enabled in range(position, disabled):
+                yield enabled
+            position = disabled + 1
+        for enabled in range(position, self.size):
+            yield enabled
+
+    def has(self, position):
+        return self._items_contains(self.items, position) != self.complemented
+
+    def popcount(self):
+        count = self._items_count(self.items)
+        return self.size - count if self.complemented else count
+
+    # Operators
+
+    def __invert__(self):
+        return self._build(self.items, not self.complemented, self.size)
+
+    def __and__(self, other):
+        a, b = self.items, other.items
+        if not self.complemented and not other.complemented:
+            return self._build(self._items_intersection(a, b), False, self.size)
+        elif not self.complemented:
+            return self._build(self._items_difference(a, b), False, self.size)
+        elif not other.complemented:
+            return self._build(self._items_difference(b, a), False, self.size)
+        return self._build(self._items_union(a, b), True, self.size)
+
+    def __or__(self, other):
+        a, b = self.items, other.items
+        if not self.complemented and not other.complemented:
+            return self._build(self._items_union(a, b), False, self.size)
+        elif not self.complemented:
+            return self._build(self._items_difference(b, a), True, self.size)
+        elif not other.complemented:
+            return self._build(self._items_difference(a, b), True, self.size)
+        return self._build(self._items_intersection(a, b), True, self.size)
+
+    def __xor__(self, other):
+        items = self._items_symmetric_difference(self.items, other.items)
+        return self._build(items, self.complemented != other.complemented, self.size)
+
+    def __bool__(self):
+        # A normalized, complemented mask has more than half of its positions enabled.
+        return self.complemented or bool(self._items_count(self.items))
+
+    def __nonzero__(self):
+        return self.__bool__()
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, self.__class__)
+            and self.size == other.size
+            and self.complemented == other.complemented
+            and self._items_key(self.items) == self._items_key(other.items)
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.complemented, self._items_key(self.items)))
+
+    def __repr__(self):
+        return '%s(%r, size=%d)' % (self.__class__.__name__, list(self.iter_positions()), self.size)
+
+    # Items containers
+
+    @classmethod
+    def _items_from_positions(cls, positions):
+        """Build items from sorted, unique positions."""
+        raise NotImplementedError()
+
+
+class SparseMask(ComplementableMask):
+    """Positions stored as a sorted array of integers."""
+    __slots__ = ()
+
+    typecode = 'I'
+
+    @classmethod
+    def _items_from_positions(cls, positions):
+        return array.array(cls.typecode, positions)
+
+    @classmethod
+    def _items_complement(cls, items, size):
+        stored = set(items)
+        return array.array(cls.typecode, [position for position in range(size) if position not in stored])
+
+    @staticmethod
+    def _items_count(items):
+        return len(items)
+
+    @staticmethod
+    def _items_iter(items):
+        return iter(items)
+
+    @staticmethod
+    def _items_contains(items, position):
+        index = bisect.bisect_left(items, position)
+        return index < len(items) and items[index] == position
+
+    @staticmethod
+    def _items_key(items):
+        return items.tobytes()
+
+    @staticmethod
+    def _items_to_int(items, size):
+        return _positions_to_int(items, size)
+
+    @classmethod
+    def _items_union(cls, a, b):
+        if not b:
+            return a
+        elif not a:
+            return b
+        return array.array(cls.typecode, sorted(set(a).union(b)))
+
+    @classmethod
+    def _items_intersection(cls, a, b):
+        if len(b) < len(a):
+            a, b = b, a
+        other = set(b)
+        return array.array(cls.typecode, [position for position in a if position in other])
+
+    @classmethod
+    def _items_difference(cls, a, b):
+        if not a or not b:
+            return a
+        other = set(b)
+        return array.array(cls.typecode, [position for position in a if position not in other])
+
+    @classmethod
+    def _items_symmetric_difference(cls, a, b):
+        if not b:
+            return a
+        elif not a:
+            return b
+        return array.array(cls.typecode, sorted(set(a).symmetric_difference(b)))
+
+
+# Width of ChunkedMask chunks
+CHUNK_SHIFT = 8
+CHUNK_BITS = 1 << CHUNK_SHIFT
+_CHUNK_LOW = CHUNK_BITS - 1
+_CHUNK_BYTES = CHUNK_BITS // 8
+
+
+class ChunkedMask(ComplementableMask):
+    """Positions stored as a dict of CHUNK_BITS-wide bitmasks, by chunk index.
+
+    Empty chunks are omitted.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_int(cls, mask, size):
+        data = mask.to_bytes((size + 7) // 8, 'little')
+        items = {}
+        for index, offset in enumerate(range(0, len(data), _CHUNK_BYTES)):
+            chunk = int.from_bytes(data[offset:offset + _CHUNK_BYTES], 'little')
+            if chunk:
+                items[index] = chunk
+        return cls._build(items, False, size)
+
+    @staticmethod
+    def _items_from_positions(positions):
+        items = {}
+        for position in positions:
+            index = position >> CHUNK_SHIFT
+            items[index] = items.get(index, 0) | 1 << (position & _CHUNK_LOW)
+        return items
+
+    @staticmethod
+    def _items_complement(items, size):
+        result = {}
+        for index in range((size + _CHUNK_LOW) >> CHUNK_SHIFT):
+            full = (1 << min(CHUNK_BITS, size - (index << CHUNK_SHIFT))) - 1
+            chunk = full & ~items.get(index, 0)
+            if chunk:
+                result[index] = chunk
+        return result
+
+    @staticmethod
+    def _items_count(items):
+        return sum(compat.popcount(chunk) for chunk in items.values())
+
+    @staticmethod
+    def _items_iter(items):
+        for index in sorted(items):
+            offset = index << CHUNK_SHIFT
+            chunk = items[index]
+            while chunk:
+                lowest = chunk & -chunk
+                yield offset + lowest.bit_length() - 1
+                chunk ^= lowest
+
+    @staticmethod
+    def _items_contains(items, position):
+        return bool(items.get(position >> CHUNK_SHIFT, 0) >> (position & _CHUNK_LOW) & 1)
+
+    @staticmethod
+    def _items_key(items):
+        return frozenset(items.items())
+
+    @staticmethod
+    def _items_to_int(items, size):
+        data = bytearray((size + 7) // 8)
+        for index, chunk in items.items():
+            offset = index * _CHUNK_BYTES
+            chunk_bytes = chunk.to_bytes(_CHUNK_BYTES, 'little')[:len(data) - offset]
+            data[offset:offset + len(chunk_bytes)] = chunk_bytes
+        return int.from_bytes(bytes(data), 'little')
+
+    @staticmethod
+    def _items_union(a, b):
+        result = dict(a)
+        for index, chunk in b.items():
+            result[index] = result.get(index, 0) | chunk
+        return result
+
+    @staticmethod
+    def _items_intersection(a, b):
+        if len(b) < len(a):
+            a, b = b, a
+        result = {}
+        for index, chunk in a.items():
+            chunk &= b.get(index, 0)
+            if chunk:
+                result[index] = chunk
+        return result
+
+    @staticmethod
+    def _items_difference(a, b):
+        result = {}
+        for index, chunk in a.items():
+            chunk &= ~b.get(index, 0)
+            if chunk:
+                result[index] = chunk
+        return result
+
+    @staticmethod
+    def _items_symmetric_difference(a, b):
+        result = dict(a)
+        for index, chunk in b.items():
+            chunk ^= result.get(index, 0)
+            if chunk:
+                result[index] = chunk
+            else:
+                del result[index]
+        return result
+
+
+MASK_TYPES = {
+    SPARSE: SparseMask,
+    CHUNKED: ChunkedMask,
+}
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+from __future__ import unicode_literals
+
+import functools
+
+"""Streaming conversion between delimited strings and constrained sets."""
+
+
+class DelimitedCodec(object):
+    """Convert streams of delimited strings (e.g. 'spam,eggs' or '|spam|eggs|').
+
+    Usage:
+    >>> codec = DelimitedCodec(Foods, sep='|', wrap=True)
+    >>> for fridge in codec.decode(line.strip() for line in open('fridges.txt')):
+    ...     pass
+
+    All methods are generators, consuming their input lazily; conversions are
+    cached for the last ``cache_size`` distinct values (0 to disable caching).
+
+    Empty items are ignored when decoding; with ``strip``, whitespace around
+    items is ignored too.
+    With ``wrap``, encoded strings start and end with the separator, as stored
+    by extypes.django.SetField.
+    """
+
+    def __init__(self, set_definition, sep=',', wrap=False, strip=True, cache_size=1024):
+        self.set_definition = set_definition
+        self.sep = sep
+        self.wrap = wrap
+        self.strip = strip
+        if cache_size:
+            self.decode_mask = functools.lru_cache(maxsize=cache_size)(self.decode_mask)
+            self.encode_mask = functools.lru_cache(maxsize=cache_size)(self.encode_mask)
+
+    # Single values
+
+    def decode_mask(self, value):
+        """Parse one delimited string into a bitmask."""
+        keys = value.split(self.sep)
+        if self.strip:
+            keys = [key.strip() for key in keys]
+        return self.set_definition._mask_from([key for key in keys if key])
+
+    def encode_mask(self, mask):
+        """Format one bitmask as a delimited string."""
+        keys = self.set_definition.from_mask(mask)._iter_keys()
+        if self.wrap:
+            return self.sep.join([''] + list(keys) + [''])
+        return self.sep.join(keys)
+
+    # Streams
+
+    def decode_masks(self, values):
+        """Convert delimited strings to bitmasks."""
+        decode_mask = self.decode_mask
+        for value in values:
+            yield decode_mask(value)
+
+    def decode(self, values):
+        """Convert delimited strings to set_definition instances."""
+        from_mask = self.set_definition._from_mask
+        for mask in self.decode_masks(values):
+            yield from_mask(mask)
+
+    def encode(self, values):
+        """Convert set_definition instances (or their bitmasks) to delimited strings."""
+        encode_mask = self.encode_mask
+        for value in values:
+            yield encode_mask(value if isinstance(value, int) else self.set_definition._mask_from(value))
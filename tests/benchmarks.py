@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+"""Benchmarks for extypes hot paths.
+
+Usage:
+    python -m tests.benchmarks [--output results.json] [--repeat 3]
+
+Results are emitted as JSON, with the best time per operation (in seconds)
+for each benchmark.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+
+import extypes
+
+from .setup_django import django, django_loaded
+
+UNIVERSE_SIZES = (3, 8, 16, 32, 64)
+DB_ROWS = 1000
+
+# Minimal duration of a timing run, in seconds.
+MIN_RUN_DURATION = 0.2
+
+
+def measure(func, repeat):
+    """Best time per call of func, in seconds."""
+    timer = timeit.Timer(func)
+    # Calls per timing run: the first power of 10 lasting at least MIN_RUN_DURATION.
+    # (Timer.autorange() requires Python 3.6)
+    number = 1
+    while timer.timeit(number=number) < MIN_RUN_DURATION:
+        number *= 10
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def core_benchmarks(size):
+    """Benchmarks for a ConstrainedSet with `size` choices."""
+    choices = ['choice%d' % i for i in range(size)]
+    Set = extypes.ConstrainedSet(choices, name=str('Set%d' % size))
+    evens = choices[::2]
+    left = Set(evens)
+    right = Set(choices[:size // 2 + 1])
+    present, absent = choices[0], choices[1]
+
+    return [
+        ('construction', lambda: Set(evens)),
+        ('contains', lambda: present in left and absent in left),
+        ('union', lambda: left | right),
+        ('intersection', lambda: left & right),
+        ('issubset', lambda: left <= right),
+        ('equality', lambda: left == right),
+        ('invert', lambda: ~left),
+        ('len', lambda: len(left)),
+        ('keys', lambda: list(left.keys())),
+        ('iter', lambda: list(left)),
+    ]
+
+
+def django_benchmarks():
+    from django.db import connection
+    from .django_test_app import models
+
+    field = models.Fridge._meta.get_field('contents')
+    Foods = field.set_definition
+    value = Foods(['spam', 'eggs'])
+    raw = field.get_prep_value(value)
+
+    models.Fridge.objects.bulk_create([
+        models.Fridge(contents=Foods(['spam', 'eggs']) if i % 2 else Foods(['bacon']), flags=['online'])
+        for i in range(DB_ROWS)
+    ])
+
+    return [
+        ('SetField.to_python', lambda: field.to_python(raw)),
+        ('SetField.from_db_value', lambda: field.from_db_value(raw, None, connection, {})),
+        ('SetField.get_prep_value', lambda: field.get_prep_value(value)),
+        ('SetField.bulk_load[%d rows]' % DB_ROWS, lambda: list(models.Fridge.objects.all())),
+    ]
+
+
+def setup_database():
+    from django.test import runner as django_test_runner
+    from django.test import utils as django_test_utils
+
+    django_test_utils.setup_test_environment()
+    runner = django_test_runner.DiscoverRunner(verbosity=0)
+    return runner, runner.setup_databases()
+
+
+def run(repeat):
+    results = []
+    for size in UNIVERSE_SIZES:
+        for name, func in core_benchmarks(size):
+            results.append({'name': name, 'choices': size, 'seconds': measure(func, repeat)})
+
+    if django_loaded:
+        runner, runner_state = setup_database()
+        try:
+            for name, func in django_benchmarks():
+                results.append({'name': name, 'choices': 3, 'seconds': measure(func, repeat)})
+        finally:
+            runner.teardown_databases(runner_state)
+
+    return {
+        'extypes': extypes.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'django': django.get_version() if django_loaded else None,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run extypes benchmarks.")
+    parser.add_argument('--output', '-o', help="Write JSON results to this file instead of stdout")
+    parser.add_argument('--repeat', '-r', type=int, default=3, help="Timing runs per benchmark; the best is kept")
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run(repeat=args.repeat), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+import extypes.django
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_test_app', '0002_alterfield'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Freezer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contents', extypes.django.SetField(
+                    blank=True, choices=[('spam', 'spam'), ('bacon', 'bacon'), ('eggs', 'eggs')], storage='bitmask')),
+                ('flags', extypes.django.SetField(
+                    blank=True,
+                    choices=[('clean', 'clean'), ('online', 'online'), ('open', 'open')],
+                    storage='bitmask',
+                )),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+import extypes.django
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_test_app', '0004_pantry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Larder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contents', extypes.django.SetField(
+                    blank=True, choices=[('spam', 'spam'), ('bacon', 'bacon'), ('eggs', 'eggs')])),
+            ],
+        ),
+    ]
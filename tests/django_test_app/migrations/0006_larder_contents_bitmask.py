@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+import extypes.django
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_test_app', '0005_larder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='larder',
+            name='contents_bitmask',
+            field=extypes.django.SetField(
+                blank=True, choices=[('spam', 'spam'), ('bacon', 'bacon'), ('eggs', 'eggs')], fallback='contents',
+                null=True, storage='bitmask'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+import extypes.django_migrations
+
+
+class Migration(migrations.Migration):
+
+    # Commit each batch separately.
+    atomic = False
+
+    dependencies = [
+        ('django_test_app', '0006_larder_contents_bitmask'),
+    ]
+
+    operations = [
+        extypes.django_migrations.ConvertSetField('larder', 'contents', 'contents_bitmask', batch_size=100),
+    ]
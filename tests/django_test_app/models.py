@@ -21,3 +21,59 @@ class Fridge(models.Model):
     )
 
     flags = extypes_django.SetField(choices=flags, blank=True)
+
+
+class Freezer(models.Model):
+    contents = extypes_django.SetField(
+        choices=[
+            ('spam', "Spam"),
+            ('bacon', "Bacon"),
+            ('eggs', "Eggs"),
+        ],
+        blank=True,
+        storage=extypes_django.STORAGE_BITMASK,
+    )
+
+    flags = extypes_django.SetField(choices=flags, blank=True, storage=extypes_django.STORAGE_BITMASK, lazy=True)
+
+
+class Pantry(models.Model):
+    contents = extypes_django.SetField(
+        choices=[
+            ('spam', "Spam"),
+            ('bacon', "Bacon"),
+            ('eggs', "Eggs"),
+        ],
+        blank=True,
+        storage=extypes_django.STORAGE_ARRAY,
+        lazy=True,
+    )
+
+    class Meta:
+        indexes = [
+            extypes_django.SetFieldGinIndex(fields=['contents'], name='pantry_contents_gin'),
+        ]
+
+
+class Larder(models.Model):
+    contents = extypes_django.SetField(
+        choices=[
+            ('spam', "Spam"),
+            ('bacon', "Bacon"),
+            ('eggs', "Eggs"),
+        ],
+        blank=True,
+    )
+
+    # Being moved to bitmask storage.
+    contents_bitmask = extypes_django.SetField(
+        choices=[
+            ('spam', "Spam"),
+            ('bacon', "Bacon"),
+            ('eggs', "Eggs"),
+        ],
+        blank=True,
+        null=True,
+        storage=extypes_django.STORAGE_BITMASK,
+        fallback='contents',
+    )
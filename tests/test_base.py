@@ -3,7 +3,13 @@
 # This code is distributed under the two-clause BSD License.
 
 
+import collections
+import copy
+import pickle
+import threading
 import unittest
+import weakref
+from unittest import mock
 
 import extypes
 
@@ -18,6 +24,81 @@ class ConstrainedSetTests(unittest.TestCase):
         self.assertEqual('Shiny', pretty.name)
         self.assertEqual('Shiny', pretty.__name__)
 
+    def test_subclass(self):
+        # Declaring choices in the class body, instead of using ConstrainedSet().
+        class Letters(extypes.base.BaseConstrainedSet):
+            choices = ['a', 'b']
+
+        letters = Letters(['a'])
+        letters.add('b')
+        self.assertIn('a', letters)
+        self.assertEqual(['a', 'b'], list(letters))
+        self.assertEqual(Letters(['b']), letters - Letters(['a']))
+        self.assertEqual('Letters', Letters.name)
+        with self.assertRaises(ValueError):
+            Letters(['c'])
+        self.assertEqual(letters, pickle.loads(pickle.dumps(letters)))
+        self.assertEqual(['a', 'b'], list(letters.freeze()))
+
+    def test_iteration(self):
+        Large = extypes.ConstrainedSet(['opt%d' % i for i in range(200)], name='Large')
+        sparse = Large(['opt150', 'opt3', 'opt199'])
+        self.assertEqual(['opt3', 'opt150', 'opt199'], list(sparse))
+        self.assertEqual('opt3,opt150,opt199', str(sparse))
+        self.assertEqual("Large(%r, ['opt3', 'opt150', 'opt199'])" % (Large.choices,), repr(sparse))
+        self.assertEqual(197, len(list(~sparse)))
+
+    def test_interning(self):
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        self.assertIs(Foods, extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods'))
+        self.assertIsNot(Foods, extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Meals'))
+        self.assertIsNot(Foods, extypes.ConstrainedSet(['spam', 'bacon', 'eggs'], name='Foods'))
+        self.assertIsNot(Foods, extypes.ConstrainedSet({'spam': 1, 'eggs': 2, 'bacon': 3}, name='Foods'))
+        self.assertEqual(Foods(['spam']), extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')(['spam']))
+
+        # Unhashable choices are still supported, without interning.
+        Lists = extypes.ConstrainedSet({'a': [1], 'b': [2]})
+        self.assertIsNot(Lists, extypes.ConstrainedSet({'a': [1], 'b': [2]}))
+        self.assertEqual(['a'], list(Lists(['a'])))
+
+    def test_compatibility(self):
+        # Names are specific to this test: compatibility is attached to the (interned) classes.
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='CompatFoods')
+        Dishes = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='CompatDishes')
+        Meals = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='CompatMeals')
+        Frozen = extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon'], name='CompatFoods')
+
+        self.assertNotEqual(Foods(['spam']), Dishes(['spam']))
+        with self.assertRaises(TypeError):
+            Foods(['spam']) | Dishes(['eggs'])
+
+        extypes.declare_compatible(Foods, Dishes)
+        self.assertEqual(Foods(['spam']), Dishes(['spam']))
+        self.assertEqual(Foods(['spam', 'eggs']), Foods(['spam']) | Dishes(['eggs']))
+        self.assertEqual(Dishes, type(Dishes(['spam']) | Foods(['eggs'])))
+        self.assertTrue(Dishes(['spam']) <= Foods(['spam', 'eggs']))
+        self.assertNotEqual(Foods(['spam']), Meals(['spam']))
+
+        # Transitive
+        extypes.declare_compatible(Meals, Frozen)
+        extypes.declare_compatible(Dishes, Meals)
+        fridge = Foods(['spam'])
+        fridge |= Frozen(['bacon'])
+        self.assertEqual(Meals(['spam', 'bacon']), fridge)
+        self.assertIs(Frozen(['spam', 'bacon']), Frozen(['spam']) | Dishes(['bacon']))
+
+        Other = extypes.ConstrainedSet(['spam', 'bacon', 'eggs'], name='CompatOther')
+        with self.assertRaises(ValueError):
+            extypes.declare_compatible(Foods, Other)
+        self.assertNotEqual(Foods(['spam']), Other(['spam']))
+
+    def test_slots(self):
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        fridge = Foods(['spam'])
+        self.assertFalse(hasattr(fridge, '__dict__'))
+        with self.assertRaises(AttributeError):
+            fridge.temperature = 4
+
     def test_set_operations(self):
         Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
         Cooking = extypes.ConstrainedSet(['cook', 'burn'], name='Cooking')
@@ -152,6 +233,127 @@ class ConstrainedSetTests(unittest.TestCase):
         fresh2 ^= white
         self.assertEqual(Foods(['bacon']), fresh2)
 
+    def test_bitmask_storage(self):
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        meat = Foods(['bacon', 'spam'])
+        self.assertEqual(0b101, meat._mask)
+        self.assertEqual(frozenset(['spam', 'bacon']), meat.enabled_choices)
+        self.assertEqual(0b010, (~meat)._mask)
+        self.assertEqual(0, len(Foods()))
+        self.assertEqual(3, len(~Foods()))
+
+        # Invalid values are rejected by every item-based operation
+        with self.assertRaises(ValueError):
+            Foods(['milk'])
+        with self.assertRaises(ValueError):
+            'milk' in meat
+        with self.assertRaises(ValueError):
+            meat.discard('milk')
+
+        # Pop yields items in choices order
+        self.assertEqual('spam', meat.pop())
+        self.assertEqual('bacon', meat.pop())
+        with self.assertRaises(KeyError):
+            meat.pop()
+
+    def test_batch_operations(self):
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        self.assertEqual(Foods(['spam', 'bacon']), Foods.from_mask(0b101))
+        self.assertEqual(Foods(), Foods.from_mask(0))
+        with self.assertRaises(ValueError):
+            Foods.from_mask(0b1000)
+        with self.assertRaises(ValueError):
+            Foods.from_mask(-1)
+
+        self.assertEqual(
+            [Foods(['spam']), Foods(), Foods(['eggs', 'bacon'])],
+            Foods.from_many([['spam'], (), Foods(['eggs', 'bacon'])]),
+        )
+        with self.assertRaises(ValueError):
+            Foods.from_many([['spam'], ['milk']])
+
+        self.assertEqual(
+            [Foods(['spam', 'eggs']), Foods(), Foods(['spam', 'eggs'])],
+            Foods.from_strings(['spam,eggs', '', 'spam,eggs']),
+        )
+        self.assertEqual([Foods(['bacon', 'eggs'])], Foods.from_strings(['|bacon|eggs|'], sep='|'))
+        with self.assertRaises(ValueError):
+            Foods.from_strings(['spam,milk'])
+        # Instances are not shared
+        first, second = Foods.from_strings(['spam', 'spam'])
+        first.add('eggs')
+        self.assertEqual(Foods(['spam']), second)
+
+        fridge = Foods(['spam'])
+        fridge.add_many(['eggs', 'bacon'])
+        self.assertEqual(Foods(['spam', 'eggs', 'bacon']), fridge)
+        fridge.discard_many(iter(['spam', 'eggs']))
+        self.assertEqual(Foods(['bacon']), fridge)
+        with self.assertRaises(ValueError):
+            fridge.add_many(['eggs', 'milk'])
+        self.assertEqual(Foods(['bacon']), fridge)
+
+    def test_bytes(self):
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        data = Foods(['spam', 'bacon']).to_bytes()
+        self.assertEqual(5, len(data))
+        self.assertEqual(b'\x05', data[-1:])
+        self.assertEqual(Foods(['spam', 'bacon']), Foods.from_bytes(data))
+        self.assertEqual(Foods(), Foods.from_bytes(Foods().to_bytes()))
+
+        # Same choices => same fingerprint
+        self.assertEqual(data, extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon'])(['spam', 'bacon']).to_bytes())
+
+        Reordered = extypes.ConstrainedSet(['eggs', 'spam', 'bacon'], name='Foods')
+        with self.assertRaises(ValueError):
+            Reordered.from_bytes(data)
+        with self.assertRaises(ValueError):
+            Foods.from_bytes(data + b'\x00')
+        with self.assertRaises(ValueError):
+            Foods.from_bytes(data[:-1] + b'\x08')
+
+        Large = extypes.ConstrainedSet(['opt%d' % i for i in range(20)])
+        self.assertEqual(7, len(Large(['opt19']).to_bytes()))
+        self.assertEqual(Large(['opt0', 'opt19']), Large.from_bytes(Large(['opt0', 'opt19']).to_bytes()))
+
+    def test_pickle(self):
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        meat = Foods(['spam', 'bacon'])
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(meat, pickle.loads(pickle.dumps(meat, protocol=protocol)))
+        # The choices aren't part of the payload
+        self.assertNotIn(b'eggs', pickle.dumps(meat))
+
+        FrozenFoods = extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        self.assertIs(FrozenFoods(meat), pickle.loads(pickle.dumps(FrozenFoods(meat))))
+
+        meat2 = copy.deepcopy(meat)
+        meat2.add('eggs')
+        self.assertEqual(Foods(['spam', 'bacon']), meat)
+
+        # Unknown classes can't be unpickled
+        data = pickle.dumps(meat)
+        with mock.patch.object(extypes.base, '_class_registry', weakref.WeakValueDictionary()):
+            with self.assertRaises(ValueError):
+                pickle.loads(data)
+
+    def test_pickle_same_name(self):
+        # Same name and keys, different labels: e.g. the default name of SetField choices.
+        Foods = extypes.ConstrainedSet({'spam': "Spam", 'eggs': "Eggs"})
+        Dishes = extypes.ConstrainedSet({'spam': "Spam!", 'eggs': "Eggs!"})
+        self.assertNotEqual(Foods._fingerprint, Dishes._fingerprint)
+        for value in (Foods(['spam']), Dishes(['spam'])):
+            self.assertEqual(value, pickle.loads(pickle.dumps(value)))
+        with self.assertRaises(ValueError):
+            Dishes.from_bytes(Foods(['spam']).to_bytes())
+
+        # Same choices, from a tuple instead of a list: unpickles to the first class.
+        Listed = extypes.ConstrainedSet(['spam', 'eggs'], name='Listed')
+        Tupled = extypes.ConstrainedSet(('spam', 'eggs'), name='Listed')
+        self.assertIsNot(Listed, Tupled)
+        self.assertEqual(Listed(['eggs']), Tupled(['eggs']))
+        self.assertEqual(Listed(['eggs']), pickle.loads(pickle.dumps(Tupled(['eggs']))))
+
     def test_extra_operations(self):
         """ConstrainedSet should get extra features when 'choices' is a dict."""
 
@@ -169,11 +371,133 @@ class ConstrainedSetTests(unittest.TestCase):
         self.assertEqual(set(["Spam", "Bacon"]), set(meat.values()))
         self.assertEqual(set([('spam', "Spam"), ('bacon', "Bacon")]), set(meat.items()))
 
+        # Views are dynamic, and ordered along choices
+        Ordered = extypes.ConstrainedSet(collections.OrderedDict([('spam', "Spam"), ('eggs', "Eggs")]))
+        menu = Ordered(['eggs'])
+        keys, values, items = menu.keys(), menu.values(), menu.items()
+        menu.add('spam')
+        self.assertEqual(['spam', 'eggs'], list(keys))
+        self.assertEqual(["Spam", "Eggs"], list(values))
+        self.assertEqual([('spam', "Spam"), ('eggs', "Eggs")], list(items))
+        self.assertEqual(2, len(keys))
+        self.assertIn('spam', keys)
+        self.assertNotIn('bacon', keys)
+        self.assertIn(('eggs', "Eggs"), items)
+        self.assertNotIn(('eggs', "Spam"), items)
+        self.assertIn("Eggs", values)
+        self.assertEqual(set(['eggs']), keys & set(['eggs', 'bacon']))
+
         self.assertEqual("Spam", meat['spam'])
         self.assertEqual("Bacon", meat['bacon'])
         with self.assertRaises(KeyError):
             meat['eggs']
 
 
+class FrozenConstrainedSetTests(unittest.TestCase):
+    def test_instantiate(self):
+        noname = extypes.FrozenConstrainedSet(['a', 'b', 'c'])
+        self.assertEqual('FrozenConstrainedSet', noname.name)
+        self.assertEqual(['a', 'b', 'c'], noname.choices)
+        self.assertIsNot(noname, extypes.ConstrainedSet(['a', 'b', 'c'], name='FrozenConstrainedSet'))
+
+    def test_subclass(self):
+        class Letters(extypes.base.BaseFrozenConstrainedSet):
+            choices = collections.OrderedDict([('a', "A"), ('b', "B")])
+
+        self.assertIs(Letters(['a']), Letters(['a']))
+        self.assertEqual(['a', 'b'], list(Letters(['b', 'a'])))
+        with self.assertRaises(ValueError):
+            Letters(['c'])
+        # Interned instances aren't shared with other classes.
+        self.assertIsNot(Letters._instances, extypes.base.BaseFrozenConstrainedSet._instances)
+
+    def test_set_operations(self):
+        Foods = extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        meat = Foods(['spam', 'bacon'])
+        fresh = Foods(['eggs', 'bacon'])
+
+        self.assertTrue('spam' in meat)
+        self.assertEqual(['spam', 'bacon'], list(meat))
+        self.assertEqual(Foods(['eggs']), ~meat)
+        self.assertEqual(Foods(['bacon']), meat & fresh)
+        self.assertTrue(Foods(['bacon']) < meat)
+
+        # No edition
+        with self.assertRaises(AttributeError):
+            meat.add('eggs')
+        meat2 = meat
+        meat2 |= fresh
+        self.assertEqual(Foods(['spam', 'eggs', 'bacon']), meat2)
+        self.assertEqual(Foods(['spam', 'bacon']), meat)
+
+    def test_interning(self):
+        Foods = extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        meat = Foods(['spam', 'bacon'])
+        self.assertIs(meat, Foods(['bacon', 'spam']))
+        self.assertIs(meat, Foods(['spam']) | Foods(['bacon']))
+        self.assertIs(meat, ~Foods(['eggs']))
+        self.assertIs(meat, meat.copy())
+
+        self.assertIs(meat, copy.copy(meat))
+        self.assertIs(meat, copy.deepcopy(meat))
+        self.assertEqual(Foods(), Foods(()))
+        self.assertIs(meat, Foods.from_mask(0b101))
+        self.assertIs(meat, Foods.from_strings(['spam,bacon'])[0])
+
+    def test_hashable(self):
+        Foods = extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        cache = {Foods(['spam']): 1, Foods(['spam', 'eggs']): 2}
+        self.assertEqual(1, cache[Foods(['spam'])])
+        self.assertEqual(2, cache[Foods(['eggs', 'spam'])])
+
+    def test_from_mutable(self):
+        MutableFoods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        Foods = extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        meat = MutableFoods(['spam', 'bacon'])
+        self.assertEqual(Foods(['spam', 'bacon']), Foods(meat))
+        self.assertEqual(meat, MutableFoods(Foods(meat)))
+        # Frozen and mutable sets can't be combined directly.
+        self.assertNotEqual(meat, Foods(meat))
+
+    def test_freeze_thaw(self):
+        MutableFoods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        Foods = extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        meat = Foods(['spam', 'bacon'])
+        self.assertIs(meat, meat.freeze())
+
+        fridge = meat.thaw()
+        self.assertIsInstance(fridge, MutableFoods)
+        self.assertEqual(MutableFoods(['spam', 'bacon']), fridge)
+        # Copies share the (immutable) mask until modified.
+        self.assertIs(meat._mask, fridge._mask)
+        self.assertIsNot(fridge, fridge.thaw())
+        self.assertIs(fridge._mask, fridge.thaw()._mask)
+
+        fridge.add('eggs')
+        self.assertEqual(Foods(['spam', 'bacon']), meat)
+        self.assertIs(Foods(['spam', 'eggs', 'bacon']), fridge.freeze())
+        self.assertIs(meat, meat.thaw().freeze())
+
+    def test_concurrent_interning(self):
+        Foods = extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon', 'ham'], name='Foods')
+        barrier = threading.Barrier(8)
+        results = []
+
+        def build():
+            barrier.wait()
+            results.append([Foods.from_mask(mask) for mask in range(16)])
+
+        threads = [threading.Thread(target=build) for _i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(8, len(results))
+        for values in results:
+            for expected, value in zip(results[0], values):
+                self.assertIs(expected, value)
+
+
 if __name__ == '__main__':
     unittest.main()
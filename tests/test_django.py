@@ -6,6 +6,7 @@
 from __future__ import absolute_import, unicode_literals
 
 import unittest
+from unittest import mock
 
 import extypes
 
@@ -31,6 +32,21 @@ else:
 test_state = {}
 
 
+def postgresql_connection():
+    """A (never connected) PostgreSQL connection, to check generated SQL."""
+    from django.core.exceptions import ImproperlyConfigured
+    try:
+        from django.db.backends.postgresql import base as pg_base
+    except ImproperlyConfigured:  # pragma: no cover
+        raise unittest.SkipTest("psycopg2 not installed")
+    settings = dict(connection.settings_dict, ENGINE='django.db.backends.postgresql', NAME='extypes')
+    return pg_base.DatabaseWrapper(settings, alias='postgresql')
+
+
+def compile_query(queryset, using):
+    return queryset.query.get_compiler(connection=using).as_sql()
+
+
 def setUpModule():
     if not django_loaded:  # pragma: no cover
         raise unittest.SkipTest("Django not installed")
@@ -93,6 +109,26 @@ class SetFieldTests(DjangoTestCase):
         self.assertEqual(Foods, field.set_definition)
         self.assertEqual(Foods.choices, dict(field.django_choices))
 
+    def test_shared_choices(self):
+        """Fields with the same choices share their set_definition."""
+        choices = [('spam', "Spam"), ('bacon', "Bacon")]
+        field = django_extypes.SetField(choices=choices)
+        self.assertIs(field.set_definition, django_extypes.SetField(choices=list(choices)).set_definition)
+        self.assertIs(models.Fridge.contents.set_definition, django_extypes.SetField(choices=[
+            ('spam', "Spam"),
+            ('bacon', "Bacon"),
+            ('eggs', "Eggs"),
+        ]).set_definition)
+        self.assertEqual(len(field.get_prep_value(field.set_definition.choices)), field.max_length)
+        # The parse cache is built on first use
+        self.assertNotIn('_parse_mask', vars(field))
+
+        # Generators and unhashable choices are supported, without sharing.
+        generated = django_extypes.SetField(choices=((key, key.title()) for key in ['spam', 'eggs']))
+        self.assertEqual(['spam', 'eggs'], list(generated.set_definition.choices))
+        unhashable = django_extypes.SetField(choices=[['spam', "Spam"]])
+        self.assertEqual(['spam'], list(unhashable.set_definition.choices))
+
     def test_base_operation(self):
         """A SetField field should act like a proper set."""
         Foods = models.Fridge.contents.set_definition
@@ -140,6 +176,29 @@ class SetFieldTests(DjangoTestCase):
 
         list(models.Fridge.objects.all())
 
+    def test_parse_cache(self):
+        """Database values are parsed once, but each row gets its own instance."""
+        field = django_extypes.SetField(choices=[('spam', "Spam"), ('bacon', "Bacon")], parse_cache_size=2)
+        Foods = field.set_definition
+        first = field.from_db_value('|spam|', None, connection, {})
+        second = field.from_db_value('|spam|', None, connection, {})
+        self.assertEqual(Foods(['spam']), first)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        self.assertEqual((1, 1), field._parse_mask.cache_info()[:2])
+
+        first.add('bacon')
+        self.assertEqual(Foods(['spam']), field.from_db_value('|spam|', None, connection, {}))
+        self.assertEqual(Foods(['spam']), field.from_db_value(['spam'], None, connection, {}))
+
+        with self.assertRaises(ValueError):
+            field.from_db_value('|milk|', None, connection, {})
+
+        uncached = django_extypes.SetField(choices=[('spam', "Spam")], parse_cache_size=0)
+        self.assertFalse(hasattr(uncached._parse_mask, 'cache_info'))
+        self.assertEqual(uncached.set_definition(['spam']), uncached.from_db_value('|spam|', None, connection, {}))
+        self.assertNotIn('parse_cache_size', uncached.deconstruct()[3])
+
     def test_get_display(self):
         """A SetField should support get_FIELD_display()."""
         Foods = models.Fridge.contents.set_definition
@@ -182,6 +241,535 @@ class SetFieldTests(DjangoTestCase):
         self.assertIn('value="spam" selected', form_html)
 
 
+@unittest.skipIf(not django_loaded, "Django not installed")
+class BitmaskSetFieldTests(DjangoTestCase):
+    def test_choices_validation(self):
+        """Bitmask storage is limited to 63 choices."""
+        django_extypes.SetField(choices=[('opt%d' % i, "Option") for i in range(63)], storage='bitmask')
+        with self.assertRaises(ValueError):
+            django_extypes.SetField(choices=[('opt%d' % i, "Option") for i in range(64)], storage='bitmask')
+        with self.assertRaises(ValueError):
+            django_extypes.SetField(choices=[('spam', "Spam")], storage='blob')
+
+    def test_prep_value(self):
+        field = models.Freezer._meta.get_field('contents')
+        Foods = models.Freezer.contents.set_definition
+        self.assertEqual('bigint', field.db_type(connection))
+        self.assertEqual(0, field.get_prep_value(Foods()))
+        self.assertEqual(0b101, field.get_prep_value(Foods(['spam', 'eggs'])))
+        self.assertEqual(0b011, field.get_prep_value(['spam', 'bacon']))
+        self.assertEqual(Foods(['bacon']), field.to_python(0b010))
+        with self.assertRaises(ValueError):
+            field.to_python(0b1000)
+        with self.assertRaises(ValueError):
+            field.to_python(-1)
+
+    def test_db_interaction(self):
+        """A bitmask SetField can be saved and restored."""
+        freezer = models.Freezer.objects.create(contents=['bacon', 'eggs'], flags=['online'])
+        freezer = models.Freezer.objects.get(pk=freezer.pk)
+        self.assertEqual(['bacon', 'eggs'], list(freezer.contents))
+        self.assertEqual(['online'], list(freezer.flags))
+
+        empty = models.Freezer.objects.create()
+        empty = models.Freezer.objects.get(pk=empty.pk)
+        self.assertEqual([], list(empty.contents))
+
+        # Stored as an integer
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT contents FROM django_test_app_freezer ORDER BY id')
+            self.assertEqual([(0b110,), (0,)], cursor.fetchall())
+
+        self.assertEqual(freezer, models.Freezer.objects.get(contents=['bacon', 'eggs']))
+
+
+@unittest.skipIf(not django_loaded, "Django not installed")
+class ArraySetFieldTests(DjangoTestCase):
+    def test_fallback(self):
+        """Array storage falls back to text outside of PostgreSQL."""
+        field = models.Pantry._meta.get_field('contents')
+        self.assertEqual('text', field.db_type(connection))
+        self.assertEqual(['spam', 'eggs'], field.get_prep_value(['eggs', 'spam']))
+        self.assertEqual('|spam|eggs|', field.get_db_prep_value(['eggs', 'spam'], connection))
+
+        pantry = models.Pantry.objects.create(contents=['bacon', 'eggs'])
+        pantry = models.Pantry.objects.get(pk=pantry.pk)
+        self.assertEqual(['bacon', 'eggs'], list(pantry.contents))
+        self.assertEqual(pantry, models.Pantry.objects.get(contents=['eggs', 'bacon']))
+
+    def test_postgresql(self):
+        pg = postgresql_connection()
+        field = models.Pantry._meta.get_field('contents')
+        self.assertEqual('varchar(5)[]', field.db_type(pg))
+        self.assertEqual(['spam', 'eggs'], field.get_db_prep_value(['eggs', 'spam'], pg))
+        Foods = models.Pantry.contents.set_definition
+        self.assertEqual(Foods(['spam', 'eggs']), field.from_db_value(['spam', 'eggs'], None, pg, {}))
+
+    def test_gin_index(self):
+        pg = postgresql_connection()
+        schema_editor = pg.SchemaEditorClass(pg, collect_sql=True)
+        index = models.Pantry._meta.indexes[0]
+        self.assertEqual(
+            'CREATE INDEX "pantry_contents_gin" ON "django_test_app_pantry" USING gin ("contents")',
+            str(index.create_sql(models.Pantry, schema_editor)),
+        )
+
+        text_index = django_extypes.SetFieldGinIndex(fields=['contents'], name='fridge_contents_gin')
+        self.assertEqual(
+            'CREATE INDEX "fridge_contents_gin" ON "django_test_app_fridge" USING gin '
+            '(string_to_array("contents", \'|\'))',
+            str(text_index.create_sql(models.Fridge, schema_editor)),
+        )
+
+        bitmask_index = django_extypes.SetFieldGinIndex(fields=['contents'], name='freezer_contents_idx')
+        self.assertNotIn('gin', str(bitmask_index.create_sql(models.Freezer, schema_editor)))
+
+        with self.assertRaises(ValueError):
+            django_extypes.SetFieldGinIndex(fields=['contents', 'flags'], name='fridge_gin')
+
+
+@unittest.skipIf(not django_loaded, "Django not installed")
+class LazySetFieldTests(DjangoTestCase):
+    def test_lazy_parsing(self):
+        """Lazy fields are only parsed on access."""
+        Foods = models.Pantry.contents.set_definition
+        field = models.Pantry._meta.get_field('contents')
+        pantry = models.Pantry.objects.create(contents=['bacon', 'spam'])
+        self.assertEqual(Foods(['bacon', 'spam']), pantry.__dict__['contents'])
+
+        pantry = models.Pantry.objects.get(pk=pantry.pk)
+        self.assertEqual('|spam|bacon|', pantry.__dict__['contents'])
+        self.assertEqual(Foods(['spam', 'bacon']), pantry.contents)
+        self.assertIs(pantry.contents, pantry.__dict__['contents'])
+        self.assertEqual("Spam, Bacon", pantry.get_contents_display())
+
+        # Values are raw
+        self.assertEqual(['|spam|bacon|'], list(models.Pantry.objects.values_list('contents', flat=True)))
+
+        # Untouched values are written back as is
+        pantry = models.Pantry.objects.get(pk=pantry.pk)
+        with mock.patch.object(field, 'from_raw', side_effect=AssertionError("Parsed")):
+            pantry.save()
+        self.assertEqual('|spam|bacon|', pantry.__dict__['contents'])
+
+        # Changes are saved
+        pantry.contents.add('eggs')
+        pantry.save()
+        self.assertEqual(Foods(['spam', 'bacon', 'eggs']), models.Pantry.objects.get(pk=pantry.pk).contents)
+
+        # Assignments on a loaded object are converted
+        pantry.contents = ['eggs']
+        self.assertEqual(Foods(['eggs']), pantry.__dict__['contents'])
+
+    def test_new_instances(self):
+        Flags = models.Freezer.flags.set_definition
+        freezer = models.Freezer(flags=['online'])
+        self.assertEqual(Flags(['online']), freezer.flags)
+        freezer.save()
+        freezer.save()
+
+        freezer = models.Freezer()
+        freezer.save()
+        freezer.save()
+        self.assertEqual(Flags(), models.Freezer.objects.get(pk=freezer.pk).flags)
+
+    def test_deferred(self):
+        Flags = models.Freezer.flags.set_definition
+        freezer = models.Freezer.objects.create(flags=['clean', 'open'])
+        freezer = models.Freezer.objects.defer('flags').get(pk=freezer.pk)
+        self.assertNotIn('flags', freezer.__dict__)
+        self.assertEqual(Flags(['clean', 'open']), freezer.flags)
+
+        freezer = models.Freezer.objects.get(pk=freezer.pk)
+        self.assertEqual(0b101, freezer.__dict__['flags'])
+        freezer.refresh_from_db()
+        self.assertEqual(Flags(['clean', 'open']), freezer.flags)
+
+
+@unittest.skipIf(not django_loaded, "Django not installed")
+class SetFieldLookupTests(DjangoTestCase):
+    def setUp(self):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            model.objects.create(contents=[])
+            model.objects.create(contents=['spam'])
+            model.objects.create(contents=['spam', 'bacon'])
+            model.objects.create(contents=['bacon', 'eggs'])
+            model.objects.create(contents=['spam', 'bacon', 'eggs'])
+
+    def assertMatches(self, expected, **lookup):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            rows = model.objects.filter(**lookup).order_by('pk')
+            self.assertEqual(expected, [list(row.contents) for row in rows], "%s: %r" % (model.__name__, lookup))
+
+    def test_has(self):
+        self.assertMatches(
+            [['spam'], ['spam', 'bacon'], ['spam', 'bacon', 'eggs']],
+            contents__has='spam',
+        )
+        self.assertMatches([['bacon', 'eggs'], ['spam', 'bacon', 'eggs']], contents__has='eggs')
+        with self.assertRaises(ValueError):
+            models.Fridge.objects.filter(contents__has='milk')
+
+    def test_has_all(self):
+        self.assertMatches([['spam', 'bacon'], ['spam', 'bacon', 'eggs']], contents__has_all=['spam', 'bacon'])
+        Foods = models.Freezer.contents.set_definition
+        self.assertMatches([['spam', 'bacon', 'eggs']], contents__has_all=~Foods())
+        self.assertEqual(5, models.Freezer.objects.filter(contents__has_all=[]).count())
+        self.assertEqual(5, models.Fridge.objects.filter(contents__has_all=[]).count())
+
+    def test_has_any(self):
+        self.assertMatches(
+            [['spam'], ['spam', 'bacon'], ['bacon', 'eggs'], ['spam', 'bacon', 'eggs']],
+            contents__has_any=['spam', 'eggs'],
+        )
+        self.assertMatches([], contents__has_any=[])
+
+    def test_subset_of(self):
+        self.assertMatches([[], ['spam'], ['spam', 'bacon']], contents__subset_of=['spam', 'bacon'])
+        self.assertMatches([[]], contents__subset_of=[])
+        self.assertEqual(5, models.Fridge.objects.filter(contents__subset_of=['spam', 'bacon', 'eggs']).count())
+
+    def test_postgresql_sql(self):
+        """On PostgreSQL, text storage relies on (GIN-indexable) array operators."""
+        pg = postgresql_connection()
+        sql, params = compile_query(models.Fridge.objects.filter(contents__has_all=['spam', 'eggs']), pg)
+        self.assertIn('string_to_array("django_test_app_fridge"."contents", %s) @> %s::text[]', sql)
+        self.assertEqual(('|', ['spam', 'eggs']), params)
+
+        sql, params = compile_query(models.Fridge.objects.filter(contents__has_any=['spam']), pg)
+        self.assertIn(' && %s::text[]', sql)
+
+        sql, params = compile_query(models.Fridge.objects.filter(contents__subset_of=['spam']), pg)
+        self.assertIn(' <@ %s::text[]', sql)
+        self.assertEqual(('|', ['', 'spam']), params)
+
+        sql, params = compile_query(models.Freezer.objects.filter(contents__has='eggs'), pg)
+        self.assertIn('(("django_test_app_freezer"."contents" & %s) = %s)', sql)
+        self.assertEqual((0b100, 0b100), params)
+
+        sql, params = compile_query(models.Pantry.objects.filter(contents__has_all=['spam', 'eggs']), pg)
+        self.assertIn('"django_test_app_pantry"."contents" @> %s::varchar[]', sql)
+        self.assertEqual((['spam', 'eggs'],), params)
+
+        sql, params = compile_query(models.Pantry.objects.filter(contents__has_any=['spam']), pg)
+        self.assertIn('"django_test_app_pantry"."contents" && %s::varchar[]', sql)
+
+        sql, params = compile_query(models.Pantry.objects.filter(contents__subset_of=['spam']), pg)
+        self.assertIn('"django_test_app_pantry"."contents" <@ %s::varchar[]', sql)
+        self.assertEqual((['spam'],), params)
+
+
+@unittest.skipIf(not django_loaded, "Django not installed")
+class SetFieldUpdateTests(DjangoTestCase):
+    def setUp(self):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            model.objects.create(contents=[])
+            model.objects.create(contents=['spam'])
+            model.objects.create(contents=['bacon', 'eggs'])
+
+    def assertUpdates(self, expected, expression):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            model.objects.update(contents=expression)
+            rows = model.objects.order_by('pk')
+            self.assertEqual(expected, [list(row.contents) for row in rows], "%s: %r" % (model.__name__, expression))
+            # Values are stored as if saved from Python.
+            field = model._meta.get_field('contents')
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT contents FROM %s ORDER BY id' % model._meta.db_table)
+                raw = [value for value, in cursor.fetchall()]
+            self.assertEqual([field.get_db_prep_value(row.contents, connection) for row in rows], raw)
+
+    def test_add(self):
+        self.assertUpdates(
+            [['spam', 'eggs'], ['spam', 'eggs'], ['spam', 'bacon', 'eggs']],
+            django_extypes.SetAdd('contents', 'eggs', 'spam'),
+        )
+        self.assertEqual(3, models.Fridge.objects.filter(contents__has_all=['spam', 'eggs']).count())
+
+    def test_remove(self):
+        self.assertUpdates([[], [], ['eggs']], django_extypes.SetRemove('contents', 'spam', 'bacon'))
+        self.assertEqual(1, models.Fridge.objects.filter(contents=['eggs']).count())
+
+    def test_toggle(self):
+        self.assertUpdates(
+            [['spam', 'eggs'], ['eggs'], ['spam', 'bacon']],
+            django_extypes.SetToggle('contents', 'spam', 'eggs'),
+        )
+        self.assertUpdates([['spam', 'eggs'], ['eggs'], ['spam', 'bacon']], django_extypes.SetToggle('contents'))
+
+    def test_lazy(self):
+        models.Freezer.objects.create(contents=[], flags=['clean'])
+        models.Freezer.objects.update(flags=django_extypes.SetAdd('flags', 'online'))
+        self.assertEqual(['clean', 'online'], list(models.Freezer.objects.get(flags__has='clean').flags))
+        self.assertEqual(4, models.Freezer.objects.filter(flags__has='online').count())
+
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            models.Fridge.objects.update(contents=django_extypes.SetAdd('contents', 'milk'))
+        with self.assertRaises(TypeError):
+            models.Fridge.objects.update(contents=django_extypes.SetAdd('id', 'spam'))
+
+    def test_postgresql_sql(self):
+        from django.db.models import sql as django_sql
+
+        pg = postgresql_connection()
+
+        def compile_update(model, expression):
+            if django.VERSION[:2] < (2, 0):
+                query = model.objects.all().query.clone(django_sql.UpdateQuery)
+            else:
+                query = model.objects.all().query.chain(django_sql.UpdateQuery)
+            query.add_update_values({'contents': expression})
+            return query.get_compiler(connection=pg).as_sql()
+
+        sql, params = compile_update(models.Freezer, django_extypes.SetRemove('contents', 'eggs'))
+        self.assertIn('SET "contents" = "django_test_app_freezer"."contents" & %s', sql)
+        self.assertEqual((0b011,), params)
+
+        sql, params = compile_update(models.Pantry, django_extypes.SetAdd('contents', 'bacon'))
+        self.assertIn(
+            'SET "contents" = array_remove(ARRAY['
+            'CASE WHEN "django_test_app_pantry"."contents" @> %s::varchar[] THEN %s END, %s, '
+            'CASE WHEN "django_test_app_pantry"."contents" @> %s::varchar[] THEN %s END'
+            ']::varchar[], NULL)',
+            sql,
+        )
+        self.assertEqual((['spam'], 'spam', 'bacon', ['eggs'], 'eggs'), params)
+
+        sql, params = compile_update(models.Fridge, django_extypes.SetToggle('contents', 'spam'))
+        self.assertIn(
+            "CASE WHEN string_to_array(\"django_test_app_fridge\".\"contents\", %s) @> %s::text[] "
+            "THEN '' ELSE %s END",
+            sql,
+        )
+        self.assertEqual(('|', '|', ['spam'], 'spam|'), params[:4])
+
+
+@unittest.skipIf(not django_loaded, "Django not installed")
+class SetExpressionTests(DjangoTestCase):
+    def setUp(self):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            model.objects.create(contents=['spam', 'bacon', 'eggs'])
+            model.objects.create(contents=[])
+            model.objects.create(contents=['eggs'])
+            model.objects.create(contents=['spam', 'eggs'])
+
+    def test_has(self):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            rows = model.objects.annotate(
+                has_spam=django_extypes.SetHas('contents', 'spam'),
+                has_both=django_extypes.SetHas('contents', 'spam', 'bacon'),
+            ).order_by('-has_spam', 'pk')
+            self.assertEqual(
+                [(['spam', 'bacon', 'eggs'], True, True), (['spam', 'eggs'], True, False),
+                 ([], False, False), (['eggs'], False, False)],
+                [(list(row.contents), row.has_spam, row.has_both) for row in rows],
+                model.__name__,
+            )
+
+    def test_case_when(self):
+        from django.db.models import Case, IntegerField, Value, When
+
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            rows = model.objects.annotate(
+                has_eggs=django_extypes.SetHas('contents', 'eggs'),
+            ).annotate(
+                rank=Case(
+                    When(has_eggs=True, then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField(),
+                ),
+            ).order_by('rank', 'pk')
+            self.assertEqual([[], ['spam', 'bacon', 'eggs'], ['eggs'], ['spam', 'eggs']],
+                             [list(row.contents) for row in rows], model.__name__)
+
+    def test_count(self):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            rows = model.objects.annotate(size=django_extypes.SetCount('contents')).order_by('-size', 'pk')
+            self.assertEqual([3, 2, 1, 0], [row.size for row in rows], model.__name__)
+            self.assertEqual([len(row.contents) for row in rows], [row.size for row in rows], model.__name__)
+            self.assertEqual(2, model.objects.annotate(
+                size=django_extypes.SetCount('contents'),
+            ).filter(size__gte=2).count())
+
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            list(models.Fridge.objects.annotate(has_milk=django_extypes.SetHas('contents', 'milk')))
+        with self.assertRaises(TypeError):
+            list(models.Fridge.objects.annotate(size=django_extypes.SetCount('id')))
+
+    def test_postgresql_sql(self):
+        pg = postgresql_connection()
+
+        sql, params = compile_query(models.Freezer.objects.annotate(
+            has_spam=django_extypes.SetHas('contents', 'spam'),
+        ), pg)
+        self.assertIn('((("django_test_app_freezer"."contents" & %s) = %s)) AS "has_spam"', sql)
+        self.assertEqual((0b001, 0b001), params)
+
+        # Comparisons to booleans keep the expression grouped.
+        sql, params = compile_query(models.Freezer.objects.annotate(
+            has_spam=django_extypes.SetHas('contents', 'spam'),
+        ).filter(has_spam=True), pg)
+        self.assertIn('WHERE ((("django_test_app_freezer"."contents" & %s) = %s)) = %s', sql)
+
+        sql, params = compile_query(models.Pantry.objects.annotate(size=django_extypes.SetCount('contents')), pg)
+        self.assertIn('COALESCE(cardinality("django_test_app_pantry"."contents"), 0) AS "size"', sql)
+
+        sql, params = compile_query(models.Fridge.objects.annotate(size=django_extypes.SetCount('contents')), pg)
+        self.assertIn(
+            'COALESCE(array_length(string_to_array("django_test_app_fridge"."contents", %s), 1) - 2, 0) AS "size"',
+            sql,
+        )
+        self.assertEqual(('|',), params)
+
+
+@unittest.skipIf(not django_loaded, "Django not installed")
+class SetChoiceCountsTests(DjangoTestCase):
+    def test_counts(self):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            counts = model.objects.aggregate(django_extypes.SetChoiceCounts('contents'))['contents__setchoicecounts']
+            self.assertEqual([('spam', 0), ('bacon', 0), ('eggs', 0)], list(counts.items()), model.__name__)
+
+            model.objects.create(contents=['spam'])
+            model.objects.create(contents=['spam', 'eggs'])
+            model.objects.create(contents=[])
+            counts = model.objects.aggregate(counts=django_extypes.SetChoiceCounts('contents'))['counts']
+            self.assertEqual([('spam', 2), ('bacon', 0), ('eggs', 1)], list(counts.items()), model.__name__)
+
+    def test_empty_queryset(self):
+        # Django doesn't query the database for pk__in=[], and aggregates to None.
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            model.objects.create(contents=['spam'])
+            empty = model.objects.filter(pk__in=[])
+            counts = empty.aggregate(counts=django_extypes.SetChoiceCounts('contents'))['counts']
+            self.assertEqual([('spam', 0), ('bacon', 0), ('eggs', 0)], list(counts.items()), model.__name__)
+
+    def test_filter_and_group(self):
+        from django.db.models import Q
+
+        models.Fridge.objects.create(contents=['spam'], flags=['clean'])
+        models.Fridge.objects.create(contents=['spam', 'eggs'], flags=['clean', 'online'])
+        models.Fridge.objects.create(contents=['bacon'], flags=['online'])
+
+        if django.VERSION[:2] >= (2, 0):
+            counts = models.Fridge.objects.aggregate(
+                counts=django_extypes.SetChoiceCounts('contents', filter=Q(flags__has='online')),
+            )['counts']
+            self.assertEqual({'spam': 1, 'bacon': 1, 'eggs': 1}, counts)
+        else:
+            with self.assertRaises(TypeError):
+                django_extypes.SetChoiceCounts('contents', filter=Q(flags__has='online'))
+
+        rows = models.Fridge.objects.values('flags').annotate(
+            counts=django_extypes.SetChoiceCounts('contents'),
+        ).order_by('flags')
+        self.assertEqual(
+            [
+                ('|clean|', {'spam': 1, 'bacon': 0, 'eggs': 0}),
+                ('|clean|online|', {'spam': 1, 'bacon': 0, 'eggs': 1}),
+                ('|online|', {'spam': 0, 'bacon': 1, 'eggs': 0}),
+            ],
+            [(models.Fridge._meta.get_field('flags').get_prep_value(row['flags']), row['counts']) for row in rows],
+        )
+
+    def test_validation(self):
+        with self.assertRaises(TypeError):
+            models.Fridge.objects.aggregate(counts=django_extypes.SetChoiceCounts('id'))
+
+    def test_postgresql_sql(self):
+        pg = postgresql_connection()
+        queryset = models.Freezer.objects.values('flags').annotate(counts=django_extypes.SetChoiceCounts('contents'))
+        sql, params = compile_query(queryset, pg)
+        self.assertIn(
+            """COUNT(CASE WHEN (("django_test_app_freezer"."contents" & %s) = %s) THEN 1 END) || ',' || COUNT(""",
+            sql,
+        )
+        self.assertEqual((0b001, 0b001, 0b010, 0b010, 0b100, 0b100), params)
+
+
+@unittest.skipIf(not django_loaded, "Django not installed")
+class SetFieldSerializationTests(DjangoTestCase):
+    def setUp(self):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            model.objects.create(contents=['eggs', 'spam'])
+            model.objects.create(contents=[])
+
+    def test_value_to_string(self):
+        field = models.Fridge._meta.get_field('contents')
+        fridge = models.Fridge(contents=['eggs', 'spam'])
+        self.assertEqual('spam|eggs', field.value_to_string(fridge))
+        self.assertEqual(field.set_definition(['spam', 'eggs']), field.to_python('spam|eggs'))
+        self.assertEqual('', field.value_to_string(models.Fridge()))
+        self.assertEqual('spam|eggs', field.raw_to_string('|spam|eggs|'))
+        self.assertEqual('spam', models.Freezer._meta.get_field('contents').raw_to_string(0b001))
+        self.assertEqual('spam|eggs', models.Pantry._meta.get_field('contents').raw_to_string(['spam', 'eggs']))
+
+    def test_roundtrip(self):
+        from django.core import serializers
+
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            data = serializers.serialize('json', model.objects.order_by('pk'))
+            self.assertIn('"contents": "spam|eggs"', data)
+            loaded = [obj.object for obj in serializers.deserialize('json', data)]
+            self.assertEqual(
+                [list(obj.contents) for obj in model.objects.order_by('pk')],
+                [list(obj.contents) for obj in loaded],
+            )
+            model.objects.all().delete()
+            for obj in serializers.deserialize('json', data):
+                obj.save()
+            self.assertEqual(1, model.objects.filter(contents__has_all=['spam', 'eggs']).count(), model.__name__)
+
+    def test_export_values_list(self):
+        for model in (models.Fridge, models.Freezer, models.Pantry):
+            queryset = model.objects.order_by('pk')
+            with mock.patch.object(model, 'from_db', side_effect=AssertionError("Models shouldn't be built")):
+                rows = list(django_extypes.export_values_list(queryset, 'pk', 'contents'))
+            self.assertEqual([(obj.pk, field) for obj, field in zip(queryset, ['spam|eggs', ''])], rows)
+
+        models.Freezer.objects.update(flags=['online'])
+        self.assertEqual(
+            [('online', 'spam|eggs'), ('online', '')],
+            list(django_extypes.export_values_list(models.Freezer.objects.order_by('pk'), 'flags', 'contents')),
+        )
+
+
+@unittest.skipIf(not django_loaded, "Django not installed")
+class SetFieldInstrumentationTests(DjangoTestCase):
+    def setUp(self):
+        from extypes import instrumentation
+        self.instrumentation = instrumentation
+        instrumentation.registry.reset()
+        self.addCleanup(instrumentation.registry.reset)
+        self.addCleanup(instrumentation.disable)
+
+    def test_counts(self):
+        label = 'django_test_app.Fridge.contents'
+        models.Fridge.objects.create(contents=['spam'])
+        list(models.Fridge.objects.all())
+        counters = self.instrumentation.registry.snapshot()['counters']
+        hits, misses = counters[(label, 'parse_cache_hits')], counters[(label, 'parse_cache_misses')]
+
+        self.instrumentation.enable()
+        models.Fridge.objects.create(contents=['spam', 'eggs', 'bacon'])
+        for _i in range(3):
+            list(models.Fridge.objects.all())
+        self.instrumentation.disable()
+        list(models.Fridge.objects.all())
+
+        snapshot = self.instrumentation.registry.snapshot()
+        timings = snapshot['timings']
+        self.assertEqual(1, timings[(label, 'get_prep_value')][0])
+        self.assertEqual(6, timings[(label, 'from_db_value')][0])
+        self.assertNotIn(('django_test_app.Freezer.contents', 'from_db_value'), timings)
+
+        # Cache statistics are always available.
+        counters = snapshot['counters']
+        self.assertEqual(misses + 1, counters[(label, 'parse_cache_misses')])
+        self.assertEqual(hits + 7, counters[(label, 'parse_cache_hits')])
+
+
 @unittest.skipIf(not django_loaded, "Django not installed")
 class SetFieldMigrationTests(DjangoTestCase):
     def test_modelstate(self):
@@ -198,6 +786,99 @@ class SetFieldMigrationTests(DjangoTestCase):
             {'blank': True, 'choices': [('spam', 'spam'), ('bacon', 'bacon'), ('eggs', 'eggs')]},
         )
 
+    def test_modelstate_storage(self):
+        field = django_extypes.SetField(choices=[('spam', "Spam")], storage=django_extypes.STORAGE_BITMASK)
+        self.assertEqual(
+            field.deconstruct()[3],
+            {'choices': [('spam', 'spam')], 'storage': 'bitmask'},
+        )
+
+
+@unittest.skipIf(not django_loaded, "Django not installed")
+class SetFieldConversionTests(DjangoTestCase):
+    def create_legacy(self, *values):
+        """Create Larder rows whose contents_bitmask column hasn't been filled yet."""
+        pks = [models.Larder.objects.create(contents=value).pk for value in values]
+        models.Larder.objects.update(contents_bitmask=None)
+        return pks
+
+    def raw_values(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT contents_bitmask FROM django_test_app_larder ORDER BY id')
+            return [value for value, in cursor.fetchall()]
+
+    def test_fallback(self):
+        pk, = self.create_legacy(['spam', 'eggs'])
+        larder = models.Larder.objects.get(pk=pk)
+        self.assertEqual(models.Larder.contents_bitmask.set_definition(['spam', 'eggs']), larder.contents_bitmask)
+        self.assertEqual([None], list(models.Larder.objects.values_list('contents_bitmask', flat=True)))
+        self.assertEqual(0, models.Larder.objects.filter(contents_bitmask__has='spam').count())
+
+        # Saving stores the value, including changes.
+        larder.contents_bitmask.add('bacon')
+        larder.save()
+        self.assertEqual([0b111], self.raw_values())
+        self.assertEqual(1, models.Larder.objects.filter(contents_bitmask__has='spam').count())
+
+        # New rows are converted on save.
+        models.Larder.objects.create(contents=['bacon'])
+        self.assertEqual([0b111, 0b010], self.raw_values())
+
+    def test_update_expressions(self):
+        self.create_legacy(['spam'])
+        for expression in (django_extypes.SetAdd, django_extypes.SetRemove, django_extypes.SetToggle):
+            with self.assertRaises(TypeError):
+                models.Larder.objects.update(contents_bitmask=expression('contents_bitmask', 'eggs'))
+        self.assertEqual([None], self.raw_values())
+        self.assertEqual(['spam'], list(models.Larder.objects.get().contents_bitmask))
+
+    def test_deferred(self):
+        pk, = self.create_legacy(['spam'])
+        larder = models.Larder.objects.defer('contents_bitmask').get(pk=pk)
+        self.assertEqual(['spam'], list(larder.contents_bitmask))
+
+    def test_convert(self):
+        pks = self.create_legacy(['spam'], [], ['bacon', 'eggs'], ['spam'], ['eggs'])
+        # Already converted, e.g. saved by the application since: left untouched.
+        models.Larder.objects.filter(pk=pks[2]).update(contents_bitmask=['spam'])
+
+        progress = []
+        converted = django_extypes.convert_set_field(
+            models.Larder.objects.all(), 'contents', 'contents_bitmask', batch_size=2,
+            progress=lambda count, last_pk: progress.append((count, last_pk)),
+        )
+        self.assertEqual(4, converted)
+        self.assertEqual([(2, pks[1]), (4, pks[4])], progress)
+        self.assertEqual([0b001, 0, 0b001, 0b001, 0b100], self.raw_values())
+
+        # Nothing left to convert.
+        self.assertEqual(
+            0, django_extypes.convert_set_field(models.Larder.objects.all(), 'contents', 'contents_bitmask'),
+        )
+
+    def test_operation(self):
+        from django.apps import apps
+        from django.db.migrations.state import ProjectState
+        from extypes import django_migrations
+
+        operation = django_migrations.ConvertSetField('larder', 'contents', 'contents_bitmask', batch_size=2)
+        self.assertEqual(
+            ('ConvertSetField', ['larder', 'contents', 'contents_bitmask'], {'batch_size': 2}),
+            operation.deconstruct(),
+        )
+        self.assertEqual("Convert larder.contents into contents_bitmask", operation.describe())
+
+        self.create_legacy(['spam', 'bacon'], ['eggs'], [])
+        state = ProjectState.from_apps(apps)
+        operation.database_forwards('django_test_app', mock.Mock(connection=connection), state, state)
+        self.assertEqual([0b011, 0b100, 0], self.raw_values())
+
+    def test_validation(self):
+        field = django_extypes.SetField(choices=[('spam', "Spam")], null=True, fallback='contents')
+        self.assertEqual({'choices': [('spam', 'spam')], 'fallback': 'contents', 'null': True}, field.deconstruct()[3])
+        with self.assertRaises(ValueError):
+            django_extypes.SetField(choices=[('spam', "Spam")], fallback='contents')
+
 
 @unittest.skipIf(not django_loaded, "Django not installed")
 class SetFieldMigrateTests(TransactionTestCase):
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+from __future__ import unicode_literals
+
+import binascii
+import unittest
+
+import extypes
+from extypes import base, instrumentation
+
+
+class InstrumentationTests(unittest.TestCase):
+    def setUp(self):
+        instrumentation.registry.reset()
+        self.addCleanup(instrumentation.registry.reset)
+        self.addCleanup(instrumentation.disable)
+
+    def timings(self):
+        return instrumentation.registry.snapshot()['timings']
+
+    def label(self, cls):
+        return '%s[%s]' % (cls.__name__, binascii.hexlify(cls._fingerprint).decode('ascii'))
+
+    def test_disabled(self):
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        original = base.AbstractConstrainedSet.__dict__['union']
+        original_from_mask = base.AbstractConstrainedSet.__dict__['from_mask']
+        Foods(['spam']) | Foods(['eggs'])
+        self.assertEqual({}, self.timings())
+        self.assertFalse(instrumentation.is_enabled())
+
+        instrumentation.enable()
+        self.assertIsNot(original, base.AbstractConstrainedSet.__dict__['union'])
+        instrumentation.disable()
+        # Original methods are restored.
+        self.assertIs(original, base.AbstractConstrainedSet.__dict__['union'])
+        self.assertIs(original_from_mask, base.AbstractConstrainedSet.__dict__['from_mask'])
+        self.assertIsInstance(base.BaseFrozenConstrainedSet.__dict__['__new__'], staticmethod)
+
+    def test_counts(self):
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        Dishes = extypes.FrozenConstrainedSet(['spam', 'eggs', 'bacon'], name='Dishes')
+        Codes = extypes.ConstrainedSet(['C%d' % i for i in range(100)], name='Codes', representation='sparse')
+        instrumentation.enable()
+
+        meat = Foods(['spam', 'bacon'])
+        meat.add('eggs')
+        self.assertEqual(Foods(['spam']), meat & Foods(['spam']))
+        with self.assertRaises(ValueError):
+            Foods(['milk'])
+        self.assertIs(Dishes(['spam']), Dishes(['spam']))
+        self.assertIn('C1', Codes(['C1']))
+        instrumentation.disable()
+        Foods(['spam'])
+
+        timings = self.timings()
+        self.assertEqual(4, timings[(self.label(Foods), '__init__')][0])
+        self.assertEqual(1, timings[(self.label(Foods), 'add')][0])
+        self.assertEqual(1, timings[(self.label(Foods), 'intersection')][0])
+        self.assertEqual(1, timings[(self.label(Foods), '__eq__')][0])
+        self.assertEqual(1, timings[(self.label(Foods), '_validate_choices')][0])
+        self.assertEqual(2, timings[(self.label(Dishes), '__new__')][0])
+        self.assertEqual(1, timings[(self.label(Codes), '__contains__')][0])
+        self.assertGreater(timings[(self.label(Foods), '__init__')][1], 0)
+
+    def test_unnamed_classes(self):
+        # e.g. classes generated for SetField choices
+        Foods = extypes.ConstrainedSet(['spam', 'eggs'])
+        Flags = extypes.ConstrainedSet(['clean', 'online'])
+        instrumentation.enable()
+        Foods(['spam'])
+        Flags(['clean'])
+        Flags(['online'])
+
+        timings = self.timings()
+        self.assertNotEqual(self.label(Foods), self.label(Flags))
+        self.assertEqual(1, timings[(self.label(Foods), '__init__')][0])
+        self.assertEqual(2, timings[(self.label(Flags), '__init__')][0])
+
+    def test_dump(self):
+        Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+        instrumentation.enable()
+        Foods(['spam']).union(Foods())
+        instrumentation.registry.add_collector(lambda: [('"Foods"', 'hits', 3)])
+        self.addCleanup(instrumentation.registry._collectors.pop)
+
+        lines = instrumentation.registry.dump().splitlines()
+        owner = self.label(Foods)
+        self.assertIn('extypes_calls_total{owner="%s",operation="union"} 1' % owner, lines)
+        self.assertIn('extypes_calls_total{owner="%s",operation="__init__"} 2' % owner, lines)
+        self.assertIn('extypes_hits{owner="\\"Foods\\""} 3', lines)
+        union_seconds = 'extypes_seconds_total{owner="%s",operation="union"} ' % owner
+        self.assertTrue(any(line.startswith(union_seconds) for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
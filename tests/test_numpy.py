@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+from __future__ import absolute_import, unicode_literals
+
+import unittest
+
+import extypes
+
+try:  # pragma: no cover
+    import numpy
+    from extypes import numpy as numpy_extypes
+    numpy_loaded = True
+except ImportError:  # pragma: no cover
+    numpy_loaded = False
+
+
+Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+
+
+@unittest.skipIf(not numpy_loaded, "numpy not installed")
+class ConstrainedSetArrayTests(unittest.TestCase):
+    def setUp(self):
+        self.column = numpy_extypes.ConstrainedSetArray.from_sets(
+            Foods,
+            [Foods(['spam', 'bacon']), ['eggs'], [], ['spam', 'eggs', 'bacon']],
+        )
+
+    def assertRows(self, expected, array):
+        self.assertEqual(expected, array.tolist())
+
+    def test_dtype(self):
+        self.assertEqual(numpy.uint8, self.column.masks.dtype)
+        Large = extypes.ConstrainedSet(['opt%d' % i for i in range(40)])
+        self.assertEqual(numpy.uint64, numpy_extypes.ConstrainedSetArray.from_sets(Large, [[]]).masks.dtype)
+        Huge = extypes.ConstrainedSet(['opt%d' % i for i in range(65)])
+        with self.assertRaises(ValueError):
+            numpy_extypes.ConstrainedSetArray.from_sets(Huge, [])
+        Sparse = extypes.ConstrainedSet(['spam', 'eggs'], representation='sparse')
+        with self.assertRaises(ValueError):
+            numpy_extypes.ConstrainedSetArray.from_sets(Sparse, [])
+
+    def test_conversion(self):
+        self.assertEqual(4, len(self.column))
+        self.assertEqual(
+            [Foods(['spam', 'bacon']), Foods(['eggs']), Foods(), Foods(['spam', 'eggs', 'bacon'])],
+            self.column.to_sets(),
+        )
+        self.assertEqual(Foods(['eggs']), self.column[1])
+        self.assertEqual([Foods(), Foods(['spam', 'eggs', 'bacon'])], list(self.column[2:]))
+        with self.assertRaises(ValueError):
+            numpy_extypes.ConstrainedSetArray.from_sets(Foods, [['milk']])
+
+    def test_tests(self):
+        self.assertRows([True, False, False, True], self.column.contains('spam'))
+        with self.assertRaises(ValueError):
+            self.column.contains('milk')
+
+        self.assertRows([False, True, False, False], self.column.equals(['eggs']))
+        self.assertRows([False, True, True, False], self.column.isdisjoint(Foods(['spam'])))
+        self.assertRows([True, False, True, False], self.column.issubset(['spam', 'bacon']))
+        self.assertRows([True, False, False, True], self.column.issuperset(['spam', 'bacon']))
+        self.assertRows([2, 1, 0, 3], self.column.popcount())
+        Large = extypes.ConstrainedSet(['opt%d' % i for i in range(40)])
+        large = numpy_extypes.ConstrainedSetArray.from_sets(Large, [['opt1', 'opt39'], ['opt2'], ['opt0'], []])
+        self.assertRows([2, 1], large[::2].popcount())
+
+        # Element-wise
+        self.assertRows([True, True, True, False], self.column.issubset(self.column[[0, 1, 0, 1]]))
+
+    def test_combination(self):
+        others = numpy_extypes.ConstrainedSetArray.from_sets(Foods, [['eggs'], ['eggs'], ['bacon'], []])
+        self.assertEqual(
+            [Foods(['spam', 'eggs', 'bacon']), Foods(['eggs']), Foods(['bacon']), Foods(['spam', 'eggs', 'bacon'])],
+            (self.column | others).to_sets(),
+        )
+        self.assertEqual([Foods(), Foods(['eggs']), Foods(), Foods()], (self.column & others).to_sets())
+        self.assertEqual(
+            [Foods(['spam']), Foods(['eggs']), Foods(), Foods(['spam', 'eggs'])],
+            (self.column - Foods(['bacon'])).to_sets(),
+        )
+        self.assertEqual(
+            [Foods(['spam', 'eggs']), Foods(['bacon']), Foods(['eggs', 'bacon']), Foods(['spam'])],
+            self.column.symmetric_difference(['eggs', 'bacon']).to_sets(),
+        )
+        self.assertEqual(
+            [Foods(['eggs']), Foods(['spam', 'bacon']), Foods(['spam', 'eggs', 'bacon']), Foods()],
+            (~self.column).to_sets(),
+        )
+        with self.assertRaises(TypeError):
+            self.column | extypes.ConstrainedSet(['cook', 'burn'])()
+        with self.assertRaises(ValueError):
+            self.column | others[:2]
+
+
+if __name__ == '__main__':
+    unittest.main()
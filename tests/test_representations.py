@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+from __future__ import unicode_literals
+
+import pickle
+import random
+import unittest
+
+import extypes
+from extypes import representations
+
+
+class MaskTests(unittest.TestCase):
+    mask_types = (representations.SparseMask, representations.ChunkedMask)
+
+    def random_positions(self, rng, size):
+        density = rng.choice([0, 0.01, 0.3, 0.5, 0.7, 0.99, 1])
+        return set(position for position in range(size) if rng.random() < density)
+
+    def test_operations(self):
+        """Masks behave like integer bitmasks."""
+        rng = random.Random(42)
+        for mask_type in self.mask_types:
+            for size in (0, 1, 7, 300, 1000):
+                full = (1 << size) - 1
+                for _i in range(20):
+                    left, right = self.random_positions(rng, size), self.random_positions(rng, size)
+                    a, b = mask_type.from_positions(left, size), mask_type.from_positions(right, size)
+                    int_a, int_b = a.to_int(), b.to_int()
+                    context = (mask_type, size, sorted(left), sorted(right))
+
+                    self.assertEqual(sorted(left), list(a.iter_positions()), context)
+                    self.assertEqual(a, mask_type.from_int(int_a, size), context)
+                    self.assertEqual(len(left), a.popcount(), context)
+                    self.assertEqual(bool(left), bool(a), context)
+                    self.assertEqual(full & ~int_a, (~a).to_int(), context)
+                    self.assertEqual(int_a | int_b, (a | b).to_int(), context)
+                    self.assertEqual(int_a & int_b, (a & b).to_int(), context)
+                    self.assertEqual(int_a ^ int_b, (a ^ b).to_int(), context)
+                    self.assertEqual(int_a & ~int_b, (a & ~b).to_int(), context)
+                    self.assertEqual(left == right, a == b, context)
+                    if size:
+                        position = rng.randrange(size)
+                        self.assertEqual(position in left, a.has(position), context)
+
+                    self.assertEqual(a, mask_type.from_bytes(a.to_bytes(), size), context)
+
+                    # Normalized: equal masks have the same hash, and store at most half of the positions.
+                    self.assertEqual(hash(a & b), hash(mask_type.from_int(int_a & int_b, size)), context)
+                    self.assertLessEqual(mask_type._items_count(a.items), size // 2, context)
+
+    def test_bytes(self):
+        for mask_type in self.mask_types:
+            mask = mask_type.from_positions([0, 3, 200, 4000], 5000)
+            self.assertEqual(b'\x00\x00\x02\xc4\x01\xd7\x1d', mask.to_bytes())
+            self.assertEqual(mask, mask_type.from_bytes(mask.to_bytes(), 5000))
+            for data in (b'', b'\x02', b'\x00\x80', b'\x00\x00\x02\xc4\x01\xd7\x1d'):
+                with self.assertRaises(ValueError):
+                    mask_type.from_bytes(data, 4000)
+
+    def test_compact(self):
+        """Sparse and dense values only store a few positions."""
+        mask = representations.SparseMask.from_positions([3, 4000], 5000)
+        self.assertEqual([3, 4000], list(mask.items))
+        self.assertEqual(4998, (~mask).popcount())
+        self.assertEqual([3, 4000], list((~mask).items))
+        chunked = representations.ChunkedMask.from_int(mask.to_int(), 5000)
+        self.assertEqual({0: 1 << 3, 15: 1 << (4000 - 15 * 256)}, chunked.items)
+
+
+class LargeConstrainedSetTests(unittest.TestCase):
+    representations = (representations.SPARSE, representations.CHUNKED)
+    codes = ['C%04d' % i for i in range(2000)]
+
+    def test_api(self):
+        Codes = extypes.ConstrainedSet(self.codes, name='Codes')
+        for representation in self.representations:
+            Large = extypes.ConstrainedSet(self.codes, name='Codes', representation=representation)
+            self.assertIsNot(Codes, Large)
+            self.assertIs(Large, extypes.ConstrainedSet(self.codes, name='Codes', representation=representation))
+
+            value = Large(['C0003', 'C1500'])
+            self.assertEqual(['C0003', 'C1500'], list(value))
+            self.assertEqual(2, len(value))
+            self.assertIn('C1500', value)
+            self.assertNotIn('C1501', value)
+            with self.assertRaises(ValueError):
+                'X' in value
+
+            inverted = ~value
+            self.assertEqual(1998, len(inverted))
+            self.assertNotIn('C0003', inverted)
+            self.assertEqual(Large(), value & inverted)
+            self.assertEqual(~Large(), value | inverted)
+            self.assertTrue(value <= ~Large(['C0004']))
+            self.assertFalse(value.isdisjoint(Large(['C0003'])))
+
+            value.add('C0004')
+            value.discard('C0003')
+            value |= Large(['C0000'])
+            self.assertEqual(['C0000', 'C0004', 'C1500'], list(value))
+            self.assertEqual('C0000', value.pop())
+            value.remove('C1500')
+            self.assertEqual(['C0004'], list(value.keys()))
+            with self.assertRaises(KeyError):
+                value.remove('C1500')
+            value.clear()
+            self.assertFalse(value)
+
+            # Integer masks and serialization
+            value = Large(['C0001', 'C1999'])
+            self.assertEqual(Codes(['C0001', 'C1999']).to_mask(), value.to_mask())
+            self.assertEqual(value, Large.from_mask(value.to_mask()))
+            # Only stored positions are serialized.
+            self.assertEqual(4 + 4, len(value.to_bytes()))
+            self.assertEqual(4 + 1, len((~Large()).to_bytes()))
+            self.assertEqual(value, Large.from_bytes(value.to_bytes()))
+            self.assertEqual(~value, Large.from_bytes((~value).to_bytes()))
+            with self.assertRaises(ValueError):
+                Large.from_bytes(Codes(['C0001', 'C1999']).to_bytes())
+            self.assertEqual(value, pickle.loads(pickle.dumps(value)))
+            with self.assertRaises(ValueError):
+                Large.from_mask(1 << 2000)
+
+    def test_frozen(self):
+        for representation in self.representations:
+            Large = extypes.FrozenConstrainedSet(self.codes, name='Codes', representation=representation)
+            value = Large(['C0001'])
+            self.assertIs(value, Large(['C0001']))
+            self.assertIs(~value, ~Large(['C0001']))
+            self.assertIs(value, pickle.loads(pickle.dumps(value)))
+            self.assertEqual({value: 1}, {Large(['C0001']): 1})
+
+    def test_compatibility(self):
+        Codes = extypes.ConstrainedSet(self.codes, name='Codes')
+        Sparse = extypes.ConstrainedSet(self.codes, name='Codes', representation=representations.SPARSE)
+        self.assertNotEqual(Codes(['C0001']), Sparse(['C0001']))
+        self.assertEqual(Sparse(['C0001']), Sparse(Codes(['C0001'])))
+        with self.assertRaises(ValueError):
+            extypes.declare_compatible(Codes, Sparse)
+        with self.assertRaises(ValueError):
+            extypes.ConstrainedSet(self.codes, representation='roaring')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Raphaël Barrois
+# This code is distributed under the two-clause BSD License.
+
+from __future__ import unicode_literals
+
+import itertools
+import unittest
+
+import extypes
+from extypes import streaming
+
+Foods = extypes.ConstrainedSet(['spam', 'eggs', 'bacon'], name='Foods')
+
+
+class DelimitedCodecTests(unittest.TestCase):
+    def test_decode(self):
+        codec = streaming.DelimitedCodec(Foods)
+        self.assertEqual(
+            [Foods(['spam', 'bacon']), Foods(), Foods(['eggs']), Foods(['spam', 'bacon'])],
+            list(codec.decode(['spam,bacon', '', ' eggs ,', 'bacon,spam'])),
+        )
+        self.assertEqual([0b101, 0b010], list(codec.decode_masks(['spam,bacon', 'eggs'])))
+        with self.assertRaises(ValueError):
+            list(codec.decode(['spam', 'milk']))
+
+    def test_decode_instances(self):
+        """Decoded instances are not shared."""
+        codec = streaming.DelimitedCodec(Foods)
+        first, second = codec.decode(['spam', 'spam'])
+        first.add('eggs')
+        self.assertEqual(Foods(['spam']), second)
+
+    def test_encode(self):
+        codec = streaming.DelimitedCodec(Foods, sep='|', wrap=True)
+        self.assertEqual(
+            ['|spam|bacon|', '|', '|eggs|'],
+            list(codec.encode([Foods(['bacon', 'spam']), Foods(), 0b010])),
+        )
+        self.assertEqual(['spam,eggs'], list(streaming.DelimitedCodec(Foods).encode([['eggs', 'spam']])))
+
+    def test_roundtrip(self):
+        codec = streaming.DelimitedCodec(Foods, sep='|', wrap=True, strip=False)
+        lines = ['|spam|', '|eggs|bacon|', '|']
+        self.assertEqual(lines, list(codec.encode(codec.decode(lines))))
+
+    def test_streaming(self):
+        """Input is consumed lazily, and distinct strings are parsed once."""
+        codec = streaming.DelimitedCodec(Foods, cache_size=2)
+        masks = codec.decode_masks(itertools.cycle(['spam', 'eggs']))
+        self.assertEqual([0b001, 0b010] * 50, list(itertools.islice(masks, 100)))
+        self.assertEqual((98, 2), codec.decode_mask.cache_info()[:2])
+
+        uncached = streaming.DelimitedCodec(Foods, cache_size=0)
+        self.assertEqual([Foods(['spam'])], list(uncached.decode(['spam'])))
+
+
+if __name__ == '__main__':
+    unittest.main()